@@ -0,0 +1,141 @@
+import argparse
+import math
+import random
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from environment import Creature, Environment, get_world
+from quantum_runner import NUM_ANGLES
+from classical_runner import NUM_WEIGHTS
+
+
+def random_actions(n, seed=0):
+    rng = random.Random(seed)
+    # bias towards moving forward so the creature actually walks around
+    return [rng.choice((0, 1, 1, 1, 2, 3)) for _ in range(n)]
+
+
+def bench_step(steps=200000, grid_size=9, wall_density=0.1, fast=True):
+    actions = random_actions(steps)
+    c = Creature(max_energy=10**9)
+    env = Environment(c, s=grid_size, seed=1, max_energy=10**9, wall_density=wall_density)
+    env.generate_food()
+    step = env.advance if fast else env.step
+
+    start = time.perf_counter()
+    for action in actions:
+        step(action)
+    elapsed = time.perf_counter() - start
+    return steps / elapsed
+
+
+def bench_world(world, grid_size, episodes=5, steps=20, wall_density=0.1):
+    # seconds per episode: building the world plus steps of sight + move
+    actions = random_actions(steps)
+    start = time.perf_counter()
+    for e in range(episodes):
+        env = get_world(world)(Creature(), s=grid_size, seed=e + 1, max_energy=steps, wall_density=wall_density)
+        env.generate_food()
+        for action in actions:
+            env.get_sight(grid_size // 2)
+            env.advance(action)
+    return (time.perf_counter() - start) / episodes
+
+
+def bench_import(module, runs=3):
+    # fresh interpreter per run, best of runs, and whether the import pulled in qiskit
+    code = (f"import sys, time; t = time.perf_counter(); import {module}; "
+            f"print(time.perf_counter() - t, any(m.split('.')[0] in ('qiskit', 'qiskit_aer') for m in sys.modules))")
+    times = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.split()
+        times.append(float(out[0]))
+    return min(times), out[1] == "True"
+
+
+def bench_spawn(method, workers=2):
+    # seconds from creating a process pool to every worker having scored a classical genome
+    import multiprocessing as mp
+    from evaluation import evaluate_genomes
+
+    genome = [0.1] * NUM_WEIGHTS
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context(method)) as executor:
+        list(executor.map(evaluate_genomes, [False] * workers, [[genome]] * workers))
+    return time.perf_counter() - start
+
+
+def bench_optimizer(optimizer, target, trials=5, budget=880, children=10, elites=2, repeats=3, sigma=3.0, quantum=True):
+    # evaluate_average calls until a candidate scores at least target, None when the budget runs out
+    import simulate
+    import simulate_classical
+
+    if optimizer == "ga":
+        generations = budget // (elites * (children + 1))
+    else:
+        n = NUM_ANGLES if quantum else NUM_WEIGHTS
+        generations = budget // (4 + int(3 * math.log(n)))
+
+    results = []
+    for trial in range(trials):
+        random.seed(trial)
+        np.random.seed(trial)
+        metrics = {}
+        module = simulate if quantum else simulate_classical
+        module.evolution(generations, children, 0.2, repeats, elites, optimizer=optimizer, sigma=sigma, metrics=metrics, target=target, verbose=False)
+        results.append(metrics.get("evaluations_to_target"))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro benchmarks for the simulation backend")
+    parser.add_argument("which", choices=["step", "optimizers", "world", "imports"])
+    parser.add_argument("--steps", type=int, default=200000)
+    parser.add_argument("--grid-size", type=int, default=9)
+    parser.add_argument("--target", type=float, default=500)
+    parser.add_argument("--trials", type=int, default=6)
+    parser.add_argument("--budget", type=int, default=880, help="evaluate_average calls per run")
+    parser.add_argument("--ga-sigma", type=float, default=None)
+    parser.add_argument("--es-sigma", type=float, default=None)
+    parser.add_argument("--classical", action="store_true")
+    args = parser.parse_args()
+
+    if args.which == "step":
+        slow = bench_step(args.steps, args.grid_size, fast=False)
+        fast = bench_step(args.steps, args.grid_size, fast=True)
+        print(f"step():    {slow:,.0f} steps/sec")
+        print(f"advance(): {fast:,.0f} steps/sec ({fast / slow:.2f}x)")
+
+    if args.which == "world":
+        for size in (args.grid_size, 100, 1000, 3000):
+            dense = bench_world("dense", size, episodes=1 if size > 1000 else 5)
+            sparse = bench_world("sparse", size)
+            print(f"grid {size:5d}: dense {dense * 1000:9.2f} ms/episode, sparse {sparse * 1000:7.2f} ms/episode")
+
+    if args.which == "imports":
+        # classical mode should never import qiskit, only quantum_runner.QuantumRunner does
+        for module in ("main", "web_helpers", "evaluation", "simulate_classical", "simulate"):
+            seconds, qiskit = bench_import(module)
+            print(f"import {module:20s} {seconds * 1000:7.1f} ms{'  (loads qiskit)' if qiskit else ''}")
+        for method in ("fork", "spawn"):
+            print(f"{method} pool of 2 workers, first evaluation: {bench_spawn(method) * 1000:7.1f} ms")
+
+    if args.which == "optimizers":
+        quantum = not args.classical
+        names = ["ga", "cmaes", "sep-cmaes"] if quantum else ["ga", "sep-cmaes"]
+        for name in names:
+            if name == "ga":
+                sigma = args.ga_sigma or (3.0 if quantum else 0.2)
+            else:
+                sigma = args.es_sigma or (1.0 if quantum else 0.2)
+            runs = bench_optimizer(name, args.target, args.trials, args.budget, sigma=sigma, quantum=quantum)
+            reached = [r for r in runs if r is not None]
+            median = statistics.median(reached) if reached else float("nan")
+            print(f"{name:10s} reached {args.target:g} in {len(reached)}/{len(runs)} runs, "
+                  f"median {median:.0f} evaluations (budget {args.budget}) {runs}")
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,19 @@
 # from tensorflow.keras import Sequential, layers
 import numpy as np
 
+# 3 vision inputs -> 32 -> 16 -> 4 actions, a bias after every dense layer
+LAYER_SHAPES = [(3, 32), (32,), (32, 16), (16,), (16, 4), (4,)]
+NUM_WEIGHTS = sum(int(np.prod(shape)) for shape in LAYER_SHAPES)
+
+# optional activation after every hidden layer's bias, the evolved networks so far are purely linear
+ACTIVATIONS = {
+    "relu": lambda x: np.maximum(x, 0),
+    "tanh": np.tanh,
+}
+
+
 class ClassicalRunner:
-    def __init__(self, weights=None):
+    def __init__(self, weights=None, activation=None):
         # self.model = Sequential([
         #     layers.Input(shape=(3,)),
         #     # layers.Dense(32, activation="relu"),
@@ -18,13 +29,10 @@ class ClassicalRunner:
         if weights:
             self.weights = weights
         else:
-            self.weights = []
-            self.weights.append(np.random.uniform(-1, 1, (3, 32)))
-            self.weights.append(np.random.uniform(-1, 1, (32,)))
-            self.weights.append(np.random.uniform(-1, 1, (32, 16)))
-            self.weights.append(np.random.uniform(-1, 1, (16,)))
-            self.weights.append(np.random.uniform(-1, 1, (16, 4)))
-            self.weights.append(np.random.uniform(-1, 1, (4,)))
+            self.weights = [np.random.uniform(-1, 1, shape) for shape in LAYER_SHAPES]
+        if activation is not None and activation not in ACTIVATIONS:
+            raise ValueError(f"Unknown activation: {activation}")
+        self.activation = activation
 
     # def _randomize_weights(self):
     #     weights = []
@@ -49,6 +57,8 @@ class ClassicalRunner:
                 x = x @ arr
             elif arr.ndim == 1:
                 x = x + arr
+                if self.activation is not None and i < len(self.weights) - 1:
+                    x = ACTIVATIONS[self.activation](x)
 
         return int(np.argmax(x))
 
@@ -56,6 +66,73 @@ class ClassicalRunner:
         # return self.model.get_weights()
         return self.weights
 
+
+class PopulationRunner:
+    # n ClassicalRunners at once, every layer stacked into one float32 tensor with a leading population axis
+    # (n, 3, 32), (n, 32), (n, 32, 16), (n, 16), (n, 16, 4), (n, 4), so n visions give n actions in one forward pass
+    def __init__(self, weights, activation=None):
+        if activation is not None and activation not in ACTIVATIONS:
+            raise ValueError(f"Unknown activation: {activation}")
+        self.weights = [np.asarray(w, dtype=np.float32) for w in weights]
+        self.activation = activation
+
+    @classmethod
+    def from_weight_sets(cls, weight_sets, activation=None):
+        # one weight list per creature, like ClassicalRunner.get_weights()
+        return cls([np.stack([np.asarray(ws[k], dtype=np.float32) for ws in weight_sets]) for k in range(len(weight_sets[0]))], activation)
+
+    @classmethod
+    def from_vectors(cls, vectors, activation=None):
+        # (n, NUM_WEIGHTS) flat genomes, see flatten_weights
+        vectors = np.asarray(vectors, dtype=np.float32)
+        weights = []
+        start = 0
+        for shape in LAYER_SHAPES:
+            size = int(np.prod(shape))
+            weights.append(vectors[:, start:start + size].reshape((len(vectors),) + shape))
+            start += size
+        return cls(weights, activation)
+
+    def __len__(self):
+        return len(self.weights[0])
+
+    def repeat(self, repeats):
+        # every creature repeats times in a row, e.g. one row per episode
+        return PopulationRunner([np.repeat(w, repeats, axis=0) for w in self.weights], self.activation)
+
+    def get_actions(self, visions):
+        # visions (n, 3), one per creature, returns the n actions
+        x = np.asarray(visions, dtype=np.float32)
+        for i, w in enumerate(self.weights):
+            if w.ndim == 3:
+                x = np.einsum("bi,bij->bj", x, w)
+            else:
+                x = x + w
+                if self.activation is not None and i < len(self.weights) - 1:
+                    x = ACTIVATIONS[self.activation](x)
+        return x.argmax(axis=1)
+
+    def get_weights(self, i):
+        return [w[i].astype(float) for w in self.weights]
+
+    def runner(self, i):
+        # a regular ClassicalRunner for creature i, e.g. to export it with create_genome_text
+        return ClassicalRunner(weights=self.get_weights(i), activation=self.activation)
+
+def flatten_weights(weights):
+    return np.concatenate([np.asarray(w, dtype=float).ravel() for w in weights])
+
+
+def unflatten_weights(vector):
+    weights = []
+    start = 0
+    for shape in LAYER_SHAPES:
+        size = int(np.prod(shape))
+        weights.append(np.asarray(vector[start:start + size], dtype=float).reshape(shape))
+        start += size
+    return weights
+
+
 def weights_to_json(weights):
     def r(x):
         return float(round(float(x), 2))
@@ -0,0 +1,184 @@
+import importlib.util
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from math import pi
+import numpy as np
+from classical_runner import NUM_WEIGHTS
+from evaluation import evaluate_genomes
+from genome import creature_from_vector
+from quantum_runner import NUM_ANGLES
+import simulate
+import simulate_classical
+
+# evaluation engines, every one scores a list of genome vectors (see genome.py) with the settings of evaluation.evaluate_genomes
+# and returns the average fitness of each, so any of them can stand in for another
+ENGINES = {}
+
+# what the evolution loops use when no engine is picked
+DEFAULT_ENGINES = {True: "decomposed", False: "batched"}
+
+ENGINE_CACHE = os.environ.get("ENGINE_CACHE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "engine_cache.json"))
+
+_evaluate_pool = None
+evaluate_workers = os.cpu_count() or 1
+
+
+def evaluate_pool():
+    global _evaluate_pool
+    if _evaluate_pool is None:
+        _evaluate_pool = ProcessPoolExecutor(max_workers=evaluate_workers)
+    return _evaluate_pool
+
+
+def register_engine(name, quantum, linear=False, available=None, seeded=True):
+    # linear engines take the same time per genome however many there are, so they can be timed on a few
+    # seeded engines draw world seeds from this process's random, so the same random.seed gives the same worlds
+    def decorator(fn):
+        ENGINES[name] = {"quantum": quantum, "run": fn, "linear": linear, "available": available or (lambda: True), "seeded": seeded}
+        return fn
+    return decorator
+
+
+def engine_names(quantum):
+    return [name for name, engine in ENGINES.items() if engine["quantum"] == quantum and engine["available"]()]
+
+
+def run_engine(name, quantum, genomes, settings):
+    if name not in ENGINES or ENGINES[name]["quantum"] != quantum:
+        raise ValueError(f"Unknown {'quantum' if quantum else 'classical'} engine: {name}")
+    return ENGINES[name]["run"](list(genomes), settings)
+
+
+def split_settings(settings):
+    settings = dict(settings)
+    shots = settings.pop("shots", None) or {}
+    return settings, shots
+
+
+@register_engine("aer", True, linear=True, available=lambda: importlib.util.find_spec("qiskit_aer") is not None)
+def evaluate_aer(genomes, settings):
+    # the full circuit on the Aer simulator, one job per step
+    from quantum_runner import QuantumRunner
+
+    settings, shots = split_settings(settings)
+    runner = QuantumRunner(shots=shots.get("shots", 32), adaptive=shots.get("adaptive_shots", False), min_shots=shots.get("min_shots", 8), max_shots=shots.get("max_shots", 32))
+    return [simulate.evaluate_average(creature_from_vector(g, True), runner, **settings) for g in genomes]
+
+
+@register_engine("decomposed", True, linear=True)
+def evaluate_decomposed(genomes, settings):
+    return evaluate_genomes(True, genomes, **settings)
+
+
+@register_engine("serial", False, linear=True)
+def evaluate_serial(genomes, settings):
+    # one ClassicalRunner forward pass per step and creature
+    settings, _ = split_settings(settings)
+    creatures = [creature_from_vector(g, False) for g in genomes]
+    return [simulate_classical.evaluate_average(c, c.model, **settings) for c in creatures]
+
+
+@register_engine("batched", False)
+def evaluate_batched(genomes, settings):
+    return evaluate_genomes(False, genomes, **settings)
+
+
+def evaluate_in_pool(quantum, genomes, settings):
+    # the genomes split evenly over the process pool
+    if not genomes:
+        return []
+    chunk = -(-len(genomes) // evaluate_workers)
+    futures = [evaluate_pool().submit(evaluate_genomes, quantum, genomes[i:i + chunk], **settings) for i in range(0, len(genomes), chunk)]
+    return [f for future in futures for f in future.result()]
+
+
+@register_engine("decomposed-pool", True, available=lambda: evaluate_workers > 1, seeded=False)
+def evaluate_decomposed_pool(genomes, settings):
+    return evaluate_in_pool(True, genomes, settings)
+
+
+@register_engine("batched-pool", False, available=lambda: evaluate_workers > 1, seeded=False)
+def evaluate_batched_pool(genomes, settings):
+    return evaluate_in_pool(False, genomes, settings)
+
+
+def tuning_key(quantum, population, settings):
+    # populations are bucketed to powers of two, the best engine doesn't change between 20 and 22 candidates
+    bucket = 1 << max(0, population - 1).bit_length()
+    return (f"{'quantum' if quantum else 'classical'}:{settings.get('world', 'dense')}:pop{bucket}:repeats{settings.get('repeats', 3)}"
+            f":grid{settings.get('grid_size', 9)}:cpus{evaluate_workers}")
+
+
+def load_cache(path=ENGINE_CACHE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache, path=ENGINE_CACHE):
+    # write then rename, two servers tuning at once just both write a complete file
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def benchmark_engines(quantum, population, settings, sample=4):
+    # seconds each available engine takes for one generation of population genomes
+    rng = np.random.default_rng(0)
+    if quantum:
+        genomes = rng.uniform(-12 * pi, 12 * pi, size=(population, NUM_ANGLES))
+    else:
+        genomes = rng.normal(0, 1, size=(population, NUM_WEIGHTS))
+
+    # evaluation draws world seeds from the global generators, a benchmark must not change what a seeded run does
+    state = random.getstate(), np.random.get_state()
+    timings = {}
+    try:
+        for name in engine_names(quantum):
+            engine = ENGINES[name]
+            n = min(population, sample) if engine["linear"] else population
+            # warm up: imports, process pool start, per process caches
+            engine["run"](list(genomes[:1]), settings)
+            start = time.perf_counter()
+            engine["run"](list(genomes[:n]), settings)
+            timings[name] = (time.perf_counter() - start) * population / n
+    finally:
+        random.setstate(state[0])
+        np.random.set_state(state[1])
+    return timings
+
+
+def choose_engine(quantum, population, settings, cache_path=ENGINE_CACHE):
+    # fastest engine for this kind of run, measured once and then read from the cache
+    # returns the engine name and the timings when they were measured just now
+    cache = load_cache(cache_path)
+    key = tuning_key(quantum, population, settings)
+    name = cache.get(key, {}).get("engine")
+    if name in engine_names(quantum):
+        return name, None
+
+    timings = benchmark_engines(quantum, population, settings)
+    name = min(timings, key=timings.get)
+    cache = load_cache(cache_path)
+    cache[key] = {"engine": name, "seconds": {k: round(v, 4) for k, v in timings.items()}}
+    save_cache(cache, cache_path)
+    return name, timings
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    settings = {"repeats": 3, "grid_size": 9, "vision_range": None, "max_moves": 5, "wall_density": 0.1, "fitness": "default", "shots": None, "world": "dense"}
+    path = os.path.join(tempfile.mkdtemp(), "engines.json")
+    for quantum in (False, True):
+        for population in (4, 22, 200):
+            name, timings = choose_engine(quantum, population, settings, path)
+            times = ", ".join(f"{k} {v * 1000:.0f} ms" for k, v in timings.items())
+            print(f"{'quantum' if quantum else 'classical'} population {population}: {name} ({times})")
@@ -1,16 +1,26 @@
 import math
 import random
+from bisect import bisect_left, bisect_right, insort
+
+
+# forward offsets per orientation: 0 up, 1 right, 2 down, 3 left
+DIRECTIONS = ((-1, 0), (0, 1), (1, 0), (0, -1))
 
 
 class Creature:
+    __slots__ = ("pos", "age", "orientation", "food_eaten", "angles", "model",
+                 "visited", "visited_count", "max_energy", "energy")
+
     def __init__(self, angles=None, model=None, max_energy=5):
-        self.pos = [0, 0]
+        self.pos = (0, 0)
         self.age = 0
         self.orientation = 0 # 0: up, 1: right 2: down 3: left
         self.food_eaten = 0
         self.angles = angles
         self.model = model
-        self.visited_positions = []
+        # bitset of visited cells, bit i is the cell at row i // size, col i % size
+        self.visited = 0
+        self.visited_count = 0
         self.max_energy = max_energy
         self.energy = self.max_energy
 
@@ -21,15 +31,18 @@ class Creature:
             return f"Creature(model={self.model})"
 
     def forward_pos(self):
-        x, y = self.pos
-        if self.orientation == 0:
-            return [x-1, y]
-        elif self.orientation == 1:
-            return [x, y+1]
-        elif self.orientation == 2:
-            return [x+1, y]
-        else:
-            return [x, y-1]
+        dx, dy = DIRECTIONS[self.orientation]
+        return self.pos[0] + dx, self.pos[1] + dy
+
+    def visit(self, index):
+        bit = 1 << index
+        if not self.visited & bit:
+            self.visited |= bit
+            self.visited_count += 1
+
+    def has_visited(self, index):
+        return bool(self.visited >> index & 1)
+
     def turn_left(self):
         self.orientation = (self.orientation - 1) % 4
 
@@ -37,11 +50,12 @@ class Creature:
         self.orientation = (self.orientation + 1) % 4
 
     def reset(self):
-        self.pos = [0, 0]
+        self.pos = (0, 0)
         self.age = 0
         self.orientation = 0
         self.food_eaten = 0
-        self.visited_positions = []
+        self.visited = 0
+        self.visited_count = 0
         self.energy = self.max_energy
 
     def normalize_angles(self):
@@ -54,11 +68,14 @@ class Environment:
         self.size = s
         self.grid = [[0] * self.size for i in range(self.size)]
         self.player = creature
-        self.player.pos = [s//2, s//2]
+        self.player.pos = (s//2, s//2)
         self.grid[s//2][s//2] = 1
         self.player.max_energy = max_energy
         self.player.energy = self.player.max_energy
         self.wall_density = wall_density
+        self.moved = False
+        self.ate = False
+        self.food_remaining = 0
 
         if seed:
             random.seed(seed)
@@ -95,6 +112,7 @@ class Environment:
         chosen = random.sample(empty, num_food)
         for i, j in chosen:
             self.grid[i][j] = 2
+        self.food_remaining += num_food
 
     def generate_walls(self, density):
         total = self.size ** 2
@@ -107,60 +125,56 @@ class Environment:
         for i, j in chosen:
             self.grid[i][j] = 3
 
-    def step(self, action):
-        ate = False
-        moved = False
+    def advance(self, action):
+        # in-place step used by the fitness simulators, outcome is left in self.moved / self.ate
+        p = self.player
+        self.moved = False
+        self.ate = False
 
         # If energy is depleted action is ignored
-        if self.player.energy <= 0:
-            return {
-                "action": action,
-                "moved": False,
-                "ate": False,
-                "position": self.player.pos,
-                "orientation": self.player.orientation,
-                "energy": self.player.energy,
-                "max_energy": self.player.max_energy
-            }
-
-        if action == 0:
-            pass
-        elif action == 1:
-            new = self.player.forward_pos()
-            if self.in_bounds(new):
-                old = self.player.pos
-                x, y = new
-                # If there's a wall, block movement
-                if self.grid[x][y] == 3:
-                    moved = False
-                else:
-                    if self.grid[x][y] == 2:
-                        ate = True
-                        self.player.food_eaten += 1
-                        self.player.energy += 5
+        if p.energy <= 0:
+            return
 
+        if action == 1:
+            dx, dy = DIRECTIONS[p.orientation]
+            x = p.pos[0] + dx
+            y = p.pos[1] + dy
+            size = self.size
+            if 0 <= x < size and 0 <= y < size:
+                row = self.grid[x]
+                cell = row[y]
+                # If there's a wall, block movement
+                if cell != 3:
+                    if cell == 2:
+                        self.ate = True
+                        self.food_remaining -= 1
+                        p.food_eaten += 1
+                        p.energy += 5
+
+                    old = p.pos
                     self.grid[old[0]][old[1]] = 0
-                    self.grid[x][y] = 1
-                    self.player.pos = new
-                    if new not in self.player.visited_positions:
-                        self.player.visited_positions.append(new)
-                    moved = True
+                    row[y] = 1
+                    p.pos = (x, y)
+                    p.visit(x * size + y)
+                    self.moved = True
 
                     # consume energy on successful forward moves
-                    self.player.energy = max(0, self.player.energy - 1)
+                    p.energy = p.energy - 1 if p.energy > 1 else 0
         elif action == 2:
-            self.player.turn_left()
+            p.orientation = (p.orientation - 1) % 4
         elif action == 3:
-            self.player.turn_right()
-        else:
+            p.orientation = (p.orientation + 1) % 4
+        elif action != 0:
             raise ValueError("Invalid action", action)
 
-        self.player.age += 1
+        p.age += 1
 
+    def step(self, action):
+        self.advance(action)
         return {
             "action": action,
-            "moved": moved,
-            "ate": ate,
+            "moved": self.moved,
+            "ate": self.ate,
             "position": self.player.pos,
             "orientation": self.player.orientation,
             "energy": self.player.energy,
@@ -219,11 +233,15 @@ class Environment:
         pg.draw.polygon(screen, TRIANGLE, int_points)
 
     def has_food(self):
-        for row in self.grid:
-            for cell in row:
-                if cell == 2:
-                    return True
-        return False
+        return self.food_remaining > 0
+
+    def window(self, radius=None):
+        # (top, left) and the rows of the part of the grid a snapshot shows, all of it by default
+        if radius is None:
+            return (0, 0), self.grid
+        r, c = self.player.pos
+        top, left = max(0, r - radius), max(0, c - radius)
+        return (top, left), [row[left:c + radius + 1] for row in self.grid[top:r + radius + 1]]
 
     def get_sight_blocks(self, n=6):
         row, col = self.player.pos
@@ -279,6 +297,260 @@ class Environment:
 
         return tuple(summary) # front, left, right
 
+
+# side of the square blocks a SparseEnvironment generates at a time
+CHUNK = 16
+
+
+class SparseEnvironment:
+    # Environment for worlds too big for a dense grid. walls and food live in a dict keyed by coordinate, with
+    # sorted per row and per column indexes for the sight queries. they are generated lazily, one CHUNK x CHUNK
+    # block at a time from the seed, the first time anything looks at or walks into the block.
+    # the layout differs from Environment for the same seed, the rules and the fitness do not.
+    def __init__(self, creature, s=9, seed=None, max_energy=5, wall_density=0.0, view_radius=10):
+        self.size = s
+        self.start = (s//2, s//2)
+        self.player = creature
+        self.player.pos = self.start
+        self.player.max_energy = max_energy
+        self.player.energy = self.player.max_energy
+        self.wall_density = wall_density
+        self.view_radius = view_radius
+        self.moved = False
+        self.ate = False
+        self.food_remaining = 0
+        self.food = False
+        # its own generator, so unlike Environment it leaves the global random alone
+        self.seed = seed if seed else random.Random().randrange(2**32)
+
+        self.cells = {}
+        self.rows = {}
+        self.cols = {}
+        self.chunks = set()
+        # visited cells, Creature's bitset would need size * size bits
+        self.visited = set()
+
+    def __repr__(self):
+        symbols = {0: '.', 1: 'C', 2: 'F', 3: '#'}
+        _, rows = self.window()
+        return "".join(" ".join(symbols[square] for square in row) + " \n" for row in rows)
+
+    def in_bounds(self, pos):
+        return 0 <= pos[0] < self.size and 0 <= pos[1] < self.size
+
+    def chunk_counts(self, h, w, has_start):
+        # walls and food in an h x w block, at the same densities as Environment
+        free = h * w - has_start
+        walls = min(int(round(self.wall_density * h * w)), free)
+        food = min(math.ceil(h * w / 9), free - walls) if self.food else 0
+        return walls, food
+
+    def chunk_size(self, index):
+        return min(CHUNK, self.size - index * CHUNK)
+
+    def generate_food(self):
+        # food is placed with the blocks, this only turns it on and counts it without generating anything
+        self.food = True
+        self.cells, self.rows, self.cols, self.chunks = {}, {}, {}, set()
+
+        full, rem = divmod(self.size, CHUNK)
+        sizes = [(CHUNK, full)] + ([(rem, 1)] if rem else [])
+        total = 0
+        for h, nh in sizes:
+            for w, nw in sizes:
+                total += nh * nw * self.chunk_counts(h, w, False)[1]
+        # the block with the start cell has one cell less to fill
+        h, w = self.chunk_size(self.start[0] // CHUNK), self.chunk_size(self.start[1] // CHUNK)
+        total += self.chunk_counts(h, w, True)[1] - self.chunk_counts(h, w, False)[1]
+        self.food_remaining += total
+
+    def generate_walls(self, density):
+        self.wall_density = density
+
+    def ensure_chunk(self, cr, cc):
+        if (cr, cc) in self.chunks:
+            return
+        self.chunks.add((cr, cc))
+        r0, c0 = cr * CHUNK, cc * CHUNK
+        h, w = self.chunk_size(cr), self.chunk_size(cc)
+        sr, sc = self.start
+        start = (sr - r0) * w + (sc - c0) if r0 <= sr < r0 + h and c0 <= sc < c0 + w else None
+        walls, food = self.chunk_counts(h, w, start is not None)
+        if walls + food == 0:
+            return
+
+        rng = random.Random(f"{self.seed}:{cr}:{cc}")
+        chosen = [k for k in rng.sample(range(h * w), min(h * w, walls + food + 1)) if k != start][:walls + food]
+        for i, k in enumerate(chosen):
+            self.place((r0 + k // w, c0 + k % w), 3 if i < walls else 2)
+
+    def place(self, pos, kind):
+        r, c = pos
+        self.cells[pos] = kind
+        insort(self.rows.setdefault(r, []), c)
+        insort(self.cols.setdefault(c, []), r)
+
+    def remove(self, pos):
+        r, c = pos
+        del self.cells[pos]
+        self.rows[r].remove(c)
+        self.cols[c].remove(r)
+
+    def cell(self, pos):
+        self.ensure_chunk(pos[0] // CHUNK, pos[1] // CHUNK)
+        return self.cells.get(pos, 0)
+
+    def nearest(self, row, col, dr, dc, n):
+        # (distance, kind) of the first wall or food within n cells, the world edge counts as a wall
+        if dr == 0:
+            fixed, pos, step, index = row, col, dc, self.rows
+        else:
+            fixed, pos, step, index = col, row, dr, self.cols
+        limit = min(pos + n, self.size - 1) if step > 0 else max(pos - n, 0)
+
+        cur = pos + step
+        while (cur <= limit) if step > 0 else (cur >= limit):
+            # one block at a time, so only the blocks up to the first hit get generated
+            block = cur // CHUNK
+            if step > 0:
+                end = min(limit, (block + 1) * CHUNK - 1)
+            else:
+                end = max(limit, block * CHUNK)
+            if dr == 0:
+                self.ensure_chunk(fixed // CHUNK, block)
+            else:
+                self.ensure_chunk(block, fixed // CHUNK)
+
+            line = index.get(fixed)
+            if line:
+                if step > 0:
+                    i = bisect_left(line, cur)
+                    hit = line[i] if i < len(line) and line[i] <= end else None
+                else:
+                    i = bisect_right(line, cur) - 1
+                    hit = line[i] if i >= 0 and line[i] >= end else None
+                if hit is not None:
+                    return abs(hit - pos), self.cells[(fixed, hit) if dr == 0 else (hit, fixed)]
+            cur = end + step
+
+        edge = self.size - pos if step > 0 else pos + 1
+        return (edge, 3) if edge <= n else None
+
+    def advance(self, action):
+        # same rules as Environment.advance
+        p = self.player
+        self.moved = False
+        self.ate = False
+
+        if p.energy <= 0:
+            return
+
+        if action == 1:
+            dx, dy = DIRECTIONS[p.orientation]
+            x = p.pos[0] + dx
+            y = p.pos[1] + dy
+            if 0 <= x < self.size and 0 <= y < self.size:
+                cell = self.cell((x, y))
+                if cell != 3:
+                    if cell == 2:
+                        self.ate = True
+                        self.remove((x, y))
+                        self.food_remaining -= 1
+                        p.food_eaten += 1
+                        p.energy += 5
+
+                    p.pos = (x, y)
+                    if p.pos not in self.visited:
+                        self.visited.add(p.pos)
+                        p.visited_count += 1
+                    self.moved = True
+
+                    p.energy = p.energy - 1 if p.energy > 1 else 0
+        elif action == 2:
+            p.orientation = (p.orientation - 1) % 4
+        elif action == 3:
+            p.orientation = (p.orientation + 1) % 4
+        elif action != 0:
+            raise ValueError("Invalid action", action)
+
+        p.age += 1
+
+    def step(self, action):
+        self.advance(action)
+        return {
+            "action": action,
+            "moved": self.moved,
+            "ate": self.ate,
+            "position": self.player.pos,
+            "orientation": self.player.orientation,
+            "energy": self.player.energy,
+            "max_energy": self.player.max_energy
+        }
+
+    def has_food(self):
+        return self.food_remaining > 0
+
+    def window(self, radius=None):
+        # only the cells around the creature, the whole world would defeat the point
+        radius = self.view_radius if radius is None else radius
+        r, c = self.player.pos
+        top, left = max(0, r - radius), max(0, c - radius)
+        bottom, right = min(self.size, r + radius + 1), min(self.size, c + radius + 1)
+        for cr in range(top // CHUNK, (bottom - 1) // CHUNK + 1):
+            for cc in range(left // CHUNK, (right - 1) // CHUNK + 1):
+                self.ensure_chunk(cr, cc)
+        rows = [[self.cells.get((i, j), 0) for j in range(left, right)] for i in range(top, bottom)]
+        rows[r - top][c - left] = 1
+        return (top, left), rows
+
+    def get_sight_blocks(self, n=6):
+        row, col = self.player.pos
+        blocks = []
+        for dr, dc in SIGHT_DIRECTIONS[self.player.orientation]:
+            dir_list = []
+            for i in range(1, n + 1):
+                r = row + dr * i
+                c = col + dc * i
+                if not self.in_bounds((r, c)):
+                    dir_list.append(2)
+                else:
+                    cell = self.cell((r, c))
+                    dir_list.append(2 if cell == 3 else 1 if cell == 2 else 0)
+            blocks.append(dir_list)
+        return tuple(blocks)
+
+    def get_sight(self, n=6):
+        # same values as Environment.get_sight, from the nearest occupant instead of walking the cells
+        row, col = self.player.pos
+        summary = []
+        for dr, dc in SIGHT_DIRECTIONS[self.player.orientation]:
+            hit = self.nearest(row, col, dr, dc, n)
+            if hit is None:
+                summary.append(0)
+            else:
+                distance, kind = hit
+                proximity = (n - distance + 1) / n
+                summary.append(proximity if kind == 2 else -proximity)
+        return tuple(summary) # front, left, right
+
+
+# front, left and right per orientation
+SIGHT_DIRECTIONS = (
+    ((-1, 0), (0, -1), (0, 1)),
+    ((0, 1), (-1, 0), (1, 0)),
+    ((1, 0), (0, 1), (0, -1)),
+    ((0, -1), (1, 0), (-1, 0)),
+)
+
+WORLDS = {"dense": Environment, "sparse": SparseEnvironment}
+
+
+def get_world(name):
+    if name not in WORLDS:
+        raise ValueError(f"Unknown world: {name}")
+    return WORLDS[name]
+
+
 if __name__ == "__main__":
     c = Creature()
     env = Environment(c, s=9)
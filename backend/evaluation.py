@@ -0,0 +1,38 @@
+from genome import creature_from_vector
+from simulate import DecomposedQuantumRunner, evaluate_average, evaluate_repeats
+from simulate_classical import evaluate_population, population_scores
+
+# evaluation entry points that only take plain data, so they can run in worker processes
+
+# one quantum runner per process and shot setting, so the per genome tables stay cached between calls
+_runners = {}
+
+
+def quantum_runner(shots=32, adaptive_shots=False, min_shots=8, max_shots=32):
+    key = (shots, adaptive_shots, min_shots, max_shots)
+    if key not in _runners:
+        _runners[key] = DecomposedQuantumRunner(shots=shots, adaptive=adaptive_shots, min_shots=min_shots, max_shots=max_shots)
+    return _runners[key]
+
+
+def evaluate_genomes(quantum, genomes, repeats=3, grid_size=9, vision_range=None, max_moves=5, wall_density=0.0, fitness="default", shots=None, world="dense",
+                     activation=None):
+    # genomes are flat vectors (see genome.py), returns the average fitness of each
+    # activation applies to every network of the call, see ClassicalRunner
+    creatures = [creature_from_vector(g, quantum, activation=activation) for g in genomes]
+    if not quantum:
+        return evaluate_population(creatures, repeats, grid_size, vision_range, max_moves, wall_density, fitness=fitness, world=world)
+
+    runner = quantum_runner(**(shots or {}))
+    return [evaluate_average(c, runner, repeats, grid_size, vision_range, max_moves, wall_density, fitness, world) for c in creatures]
+
+
+def evaluate_genome_scores(quantum, genomes, repeats=3, grid_size=9, vision_range=None, max_moves=5, wall_density=0.0, fitness="default", shots=None, world="dense",
+                           activation=None):
+    # like evaluate_genomes, but keeps every episode score, one list of repeats per genome
+    creatures = [creature_from_vector(g, quantum, activation=activation) for g in genomes]
+    if not quantum:
+        return population_scores(creatures, repeats, grid_size, vision_range, max_moves, wall_density, fitness=fitness, world=world).tolist()
+
+    runner = quantum_runner(**(shots or {}))
+    return [evaluate_repeats(c, runner, repeats, grid_size, vision_range, max_moves, wall_density, fitness, world) for c in creatures]
@@ -0,0 +1,51 @@
+# registry of named fitness functions, each takes batched episode stats (ints or numpy arrays)
+FITNESS_FUNCTIONS = {}
+
+
+def register_fitness(name):
+    def decorator(fn):
+        FITNESS_FUNCTIONS[name] = fn
+        return fn
+    return decorator
+
+
+def get_fitness(name):
+    if name not in FITNESS_FUNCTIONS:
+        raise ValueError(f"Unknown fitness function: {name}")
+    return FITNESS_FUNCTIONS[name]
+
+
+@register_fitness("default")
+def compute_fitness(food_eaten, food_remaining, visited, energy, age=0):
+    fitness = food_eaten * 100 + visited
+
+    # large bonus for clearing all food
+    fitness = fitness + 1000 * (food_remaining <= 0)
+
+    # penalty for running out of energy, small bonus otherwise
+    fitness = fitness + 20 - 70 * (energy <= 0)
+    return fitness
+
+
+@register_fitness("food")
+def food_fitness(food_eaten, food_remaining, visited, energy, age=0):
+    # only eating matters
+    return food_eaten * 100 + 1000 * (food_remaining <= 0)
+
+
+@register_fitness("explore")
+def explore_fitness(food_eaten, food_remaining, visited, energy, age=0):
+    # rewards covering ground over eating
+    return visited * 10 + food_eaten * 20
+
+
+@register_fitness("survival")
+def survival_fitness(food_eaten, food_remaining, visited, energy, age=0):
+    # rewards staying alive for as many steps as possible
+    return age * 10 + energy
+
+
+def episode_fitness(env, name="default"):
+    # O(1), every component is tracked by the environment as the episode runs
+    p = env.player
+    return get_fitness(name)(p.food_eaten, env.food_remaining, p.visited_count, p.energy, p.age)
@@ -0,0 +1,32 @@
+import numpy as np
+from environment import Creature
+from classical_runner import LAYER_SHAPES, ClassicalRunner, flatten_weights, unflatten_weights
+from optimizers import GA
+
+
+def genome_vector(creature, quantum):
+    # flat float vector of everything evolution changes
+    if quantum:
+        return np.asarray(creature.angles, dtype=float)
+    return flatten_weights(creature.model.get_weights())
+
+
+def creature_from_vector(vector, quantum, max_energy=5, activation=None):
+    # the vector only holds weights, a network's activation is passed along
+    if quantum:
+        return Creature(angles=[float(x) for x in vector], max_energy=max_energy)
+    return Creature(model=ClassicalRunner(weights=unflatten_weights(vector), activation=activation), max_energy=max_energy)
+
+
+def make_ga(quantum, parents, children, chance, sigma, elites=None, resample_clones=False):
+    # the GA of the evolution loops over genome vectors, see optimizers.GA
+    # an angle gets uniform noise on its own, a network layer normal noise as a whole
+    if quantum:
+        return GA(parents, children, chance, sigma, elites, noise="uniform", resample_clones=resample_clones)
+    blocks = []
+    start = 0
+    for shape in LAYER_SHAPES:
+        size = int(np.prod(shape))
+        blocks.append((start, start + size))
+        start += size
+    return GA(parents, children, chance, sigma, elites, blocks, noise="normal", resample_clones=resample_clones)
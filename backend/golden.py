@@ -0,0 +1,307 @@
+import argparse
+import json
+import os
+import random
+import sys
+from math import pi
+import numpy as np
+import engines
+from classical_runner import NUM_WEIGHTS, PopulationRunner
+from environment import Creature, get_world
+from fitness import FITNESS_FUNCTIONS, episode_fitness
+from genome import creature_from_vector
+from quantum_runner import NUM_ANGLES, DecomposedQuantumRunner, counts_to_array
+from rollout import build_worlds, rollout_classical
+import simulate_classical
+
+# golden trajectories and fitness values from the reference implementations, so a faster engine can be checked against them
+#   python golden.py record   writes golden.json from the reference implementations (Environment.step, ClassicalRunner, Aer)
+#   python golden.py check    checks every engine against it: exact for deterministic paths, chi-square / t tests for sampled ones
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden.json")
+
+SETTINGS = {"repeats": 4, "grid_size": 9, "vision_range": None, "max_moves": 8, "wall_density": 0.1, "fitness": "default", "shots": None, "world": "dense"}
+ENV_CASES = [("dense", 1, 9, 0.0), ("dense", 2, 9, 0.2), ("dense", 3, 15, 0.1), ("dense", 4, 31, 0.3), ("sparse", 5, 9, 0.1), ("sparse", 6, 200, 0.2)]
+ENV_STEPS = 80
+EPISODE_SEEDS = [11, 12, 13, 14, 15]
+# genomes evaluated REPLICAS times each, for the fitness distribution of every engine
+REPLICAS = 8
+COUNT_SHOTS = 4096
+DECISIONS = 400
+ENGINE_SEED = 123
+
+# chi-square critical values at p = 1e-4, by degrees of freedom
+CHI2_CRITICAL = {1: 15.137, 2: 18.421, 3: 21.108}
+T_LIMIT = 5.0
+
+
+def reference_genomes(quantum, n):
+    rng = np.random.default_rng(7 if quantum else 3)
+    if quantum:
+        return rng.uniform(-12 * pi, 12 * pi, size=(n, NUM_ANGLES)).tolist()
+    return rng.normal(0, 1, size=(n, NUM_WEIGHTS)).tolist()
+
+
+def reference_visions():
+    corners = [[a, b, c] for a in (-1.0, 1.0) for b in (-1.0, 1.0) for c in (-1.0, 1.0)]
+    return corners + [[0.0, 0.0, 0.0], [0.25, -0.5, 0.75], [-0.8, 0.4, 0.0], [0.6, 0.6, -0.2]]
+
+
+def env_trajectory(world, seed, grid_size, wall_density, fast):
+    # a fixed random walk, the state after every step
+    rng = random.Random(seed)
+    actions = [rng.choice((0, 1, 1, 1, 2, 3)) for _ in range(ENV_STEPS)]
+    env = get_world(world)(Creature(max_energy=ENV_STEPS // 2), s=grid_size, seed=seed, max_energy=ENV_STEPS // 2, wall_density=wall_density)
+    env.generate_food()
+    states = []
+    for action in actions:
+        if fast:
+            env.advance(action)
+        else:
+            env.step(action)
+        p = env.player
+        states.append([p.pos[0], p.pos[1], p.orientation, p.energy, p.food_eaten, env.food_remaining] + list(env.get_sight(grid_size // 2)))
+    return {"actions": actions, "states": states, "fitness": {name: episode_fitness(env, name) for name in FITNESS_FUNCTIONS}}
+
+
+def episode(creature, decide, seed, settings):
+    # simulate.simulate / simulate_classical.simulate, keeping the actions
+    grid_size = settings["grid_size"]
+    env = get_world(settings["world"])(creature, s=grid_size, seed=seed, max_energy=settings["max_moves"], wall_density=settings["wall_density"])
+    env.generate_food()
+    vr = settings["vision_range"] if settings["vision_range"] is not None else grid_size // 2
+    actions = []
+    for _ in range(20):
+        action = decide(env.get_sight(n=vr))
+        env.advance(action)
+        actions.append(action)
+        if env.player.energy <= 0:
+            break
+    return actions, episode_fitness(env, settings["fitness"])
+
+
+def engine_samples(name, quantum, genomes, settings):
+    # REPLICAS averages over settings["repeats"] episodes for every genome, (genomes, REPLICAS)
+    fits = engines.run_engine(name, quantum, [g for g in genomes for _ in range(REPLICAS)], settings)
+    return np.asarray(fits, dtype=float).reshape(len(genomes), REPLICAS).tolist()
+
+
+def sample_counts(runner, angles, vision, n):
+    # shot counts of the runner's circuit, ordered like ACTION_VALUES
+    if isinstance(runner, DecomposedQuantumRunner):
+        return runner.rng.multinomial(n, runner.action_distribution(angles, vision))
+    return counts_to_array(runner.sim.run(runner.bound_circuit(angles, vision), shots=n).result().get_counts())
+
+
+def decision_histogram(runner, angles, vision, n=DECISIONS):
+    hist = [0, 0, 0, 0]
+    for _ in range(n):
+        hist[runner.get_action(angles, vision)] += 1
+    return hist
+
+
+def record(path=GOLDEN_PATH):
+    from quantum_runner import QuantumRunner
+
+    golden = {"settings": SETTINGS, "environment": [], "classical": {}, "quantum": {}}
+
+    # environment, reference is step()
+    for world, seed, grid_size, wall_density in ENV_CASES:
+        case = {"world": world, "seed": seed, "grid_size": grid_size, "wall_density": wall_density}
+        case.update(env_trajectory(world, seed, grid_size, wall_density, fast=False))
+        golden["environment"].append(case)
+
+    # classical, reference is one ClassicalRunner per creature
+    genomes = reference_genomes(False, 4)
+    episodes = []
+    for i, g in enumerate(genomes):
+        for seed in EPISODE_SEEDS:
+            c = creature_from_vector(g, False)
+            actions, fit = episode(c, c.model.get_action, seed, SETTINGS)
+            episodes.append({"genome": i, "seed": seed, "actions": actions, "fitness": fit})
+    random.seed(ENGINE_SEED)
+    means = engines.run_engine("serial", False, genomes, SETTINGS)
+    golden["classical"] = {"genomes": genomes, "episodes": episodes, "engine_means": means,
+                           "engine_samples": engine_samples("serial", False, genomes, SETTINGS)}
+
+    # quantum, reference is the circuit on Aer
+    genomes = reference_genomes(True, 3)
+    visions = reference_visions()
+    aer = QuantumRunner()
+    counts = [[sample_counts(aer, g, v, COUNT_SHOTS).tolist() for v in visions] for g in genomes]
+    decisions = [[decision_histogram(aer, genomes[0], v) for v in visions[:4]]]
+    # the numpy engine with a fixed generator is deterministic, its episodes are kept to catch drift in it
+    episodes = []
+    for i, g in enumerate(genomes):
+        for seed in EPISODE_SEEDS:
+            runner = DecomposedQuantumRunner(seed=seed)
+            actions, fit = episode(Creature(angles=list(g), max_energy=SETTINGS["max_moves"]), lambda v: runner.get_action(g, v), seed, SETTINGS)
+            episodes.append({"genome": i, "seed": seed, "actions": actions, "fitness": fit})
+    golden["quantum"] = {"genomes": genomes, "visions": visions, "shots": COUNT_SHOTS, "counts": counts, "decisions": decisions, "episodes": episodes,
+                         "engine_samples": engine_samples("aer", True, genomes, SETTINGS)}
+
+    with open(path, "w") as f:
+        json.dump(golden, f)
+    return golden
+
+
+def chi2_homogeneity(a, b):
+    # two samples of counts from the same distribution? statistic and degrees of freedom
+    table = np.array([a, b], dtype=float)
+    table = table[:, table.sum(axis=0) > 0]
+    if table.shape[1] < 2:
+        return 0.0, 1
+    expected = table.sum(axis=1, keepdims=True) * table.sum(axis=0, keepdims=True) / table.sum()
+    return float(((table - expected) ** 2 / expected).sum()), table.shape[1] - 1
+
+
+def chi2_fit(counts, p):
+    # counts drawn from the distribution p? statistic and degrees of freedom
+    counts = np.asarray(counts, dtype=float)
+    expected = counts.sum() * np.asarray(p, dtype=float)
+    if np.any((expected < 1e-9) & (counts > 0)):
+        return float("inf"), 1
+    keep = expected >= 1e-9
+    stat = float(((counts[keep] - expected[keep]) ** 2 / expected[keep]).sum())
+    return stat, max(1, int(keep.sum()) - 1)
+
+
+def welch_t(a, b):
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    se = np.sqrt(a.var(ddof=1) / len(a) + b.var(ddof=1) / len(b))
+    diff = a.mean() - b.mean()
+    if se == 0:
+        return 0.0 if diff == 0 else float("inf")
+    return float(diff / se)
+
+
+def check_environment(golden):
+    results = []
+    for case in golden["environment"]:
+        label = f"{case['world']} seed {case['seed']} grid {case['grid_size']}"
+        for fast in (False, True):
+            got = env_trajectory(case["world"], case["seed"], case["grid_size"], case["wall_density"], fast)
+            steps = [i for i, (a, b) in enumerate(zip(got["states"], case["states"])) if a != b]
+            ok = not steps and got["fitness"] == case["fitness"]
+            detail = "" if ok else f"first difference at step {steps[0]}" if steps else "fitness differs"
+            results.append((f"environment {'advance' if fast else 'step'}: {label}", ok, detail))
+    return results
+
+
+def check_classical(golden):
+    results = []
+    g = golden["classical"]
+    genomes = g["genomes"]
+    settings = golden["settings"]
+
+    bad = []
+    for e in g["episodes"]:
+        c = creature_from_vector(genomes[e["genome"]], False)
+        actions, fit = episode(c, c.model.get_action, e["seed"], settings)
+        # and the simulator the evolution uses, on a fresh creature
+        c = creature_from_vector(genomes[e["genome"]], False)
+        _, simulated = simulate_classical.simulate(c, c.model, e["seed"], 20, settings["grid_size"], settings["vision_range"], settings["max_moves"],
+                                                   settings["wall_density"], settings["fitness"])
+        if actions != e["actions"] or fit != e["fitness"] or simulated != e["fitness"]:
+            bad.append((e["genome"], e["seed"]))
+    results.append(("classical runner episodes", not bad, f"{len(bad)} episodes differ, first {bad[0]}" if bad else ""))
+
+    # the batched rollout on the same worlds
+    population = PopulationRunner.from_vectors([genomes[e["genome"]] for e in g["episodes"]])
+    grids = np.stack([build_worlds([e["seed"]], settings["grid_size"], settings["max_moves"], settings["wall_density"])[0] for e in g["episodes"]])
+    scores = rollout_classical(population, grids, vision_range=settings["vision_range"], max_moves=settings["max_moves"], fitness=settings["fitness"])
+    bad = [i for i, (s, e) in enumerate(zip(scores.tolist(), g["episodes"])) if s != e["fitness"]]
+    results.append(("classical batched rollout", not bad, f"{len(bad)} of {len(scores)} episodes differ" if bad else ""))
+
+    for name in engines.engine_names(False):
+        if engines.ENGINES[name]["seeded"]:
+            random.seed(ENGINE_SEED)
+            means = engines.run_engine(name, False, genomes, settings)
+            results.append((f"classical engine {name}: seeded means", means == g["engine_means"], "" if means == g["engine_means"] else f"{means} != {g['engine_means']}"))
+        results.append(check_samples(f"classical engine {name}", engine_samples(name, False, genomes, settings), g["engine_samples"]))
+    return results
+
+
+def check_samples(label, samples, reference):
+    ts = [welch_t(a, b) for a, b in zip(samples, reference)]
+    worst = max(abs(t) for t in ts)
+    return f"{label}: fitness distribution", worst < T_LIMIT, f"|t| {worst:.2f}"
+
+
+def check_quantum(golden):
+    from quantum_runner import QuantumRunner
+
+    results = []
+    g = golden["quantum"]
+    genomes, visions = g["genomes"], g["visions"]
+    settings = golden["settings"]
+    runners = {"aer": QuantumRunner, "decomposed": DecomposedQuantumRunner}
+
+    for name, cls in runners.items():
+        if name not in engines.engine_names(True):
+            results.append((f"quantum runner {name}", True, "not available, skipped"))
+            continue
+        runner = cls()
+        # the measured distribution against the golden Aer counts
+        worst = 0.0
+        for gi, angles in enumerate(genomes):
+            for vi, vision in enumerate(visions):
+                if isinstance(runner, DecomposedQuantumRunner):
+                    stat, df = chi2_fit(g["counts"][gi][vi], runner.action_distribution(angles, vision))
+                else:
+                    stat, df = chi2_homogeneity(sample_counts(runner, angles, vision, g["shots"]), g["counts"][gi][vi])
+                worst = max(worst, stat / CHI2_CRITICAL[min(df, 3)])
+        results.append((f"quantum runner {name}: circuit distribution", worst < 1, f"worst chi2 at {worst:.2f} of the critical value"))
+
+        # the shot sampled actions
+        worst = 0.0
+        for vi, hist in enumerate(g["decisions"][0]):
+            stat, df = chi2_homogeneity(decision_histogram(runner, genomes[0], visions[vi]), hist)
+            worst = max(worst, stat / CHI2_CRITICAL[min(df, 3)])
+        results.append((f"quantum runner {name}: sampled actions", worst < 1, f"worst chi2 at {worst:.2f} of the critical value"))
+
+    bad = []
+    for e in g["episodes"]:
+        angles = genomes[e["genome"]]
+        runner = DecomposedQuantumRunner(seed=e["seed"])
+        actions, fit = episode(Creature(angles=list(angles), max_energy=settings["max_moves"]), lambda v: runner.get_action(angles, v), e["seed"], settings)
+        if actions != e["actions"] or fit != e["fitness"]:
+            bad.append((e["genome"], e["seed"]))
+    results.append(("quantum decomposed seeded episodes", not bad, f"{len(bad)} episodes differ, first {bad[0]}" if bad else ""))
+
+    for name in engines.engine_names(True):
+        results.append(check_samples(f"quantum engine {name}", engine_samples(name, True, genomes, settings), g["engine_samples"]))
+    return results
+
+
+def check(path=GOLDEN_PATH):
+    with open(path) as f:
+        golden = json.load(f)
+    # the global generators drive world seeds and classical mutation, checks are repeatable run to run
+    random.seed(0)
+    np.random.seed(0)
+    return check_environment(golden) + check_classical(golden) + check_quantum(golden)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record or check golden trajectories of the reference engines")
+    parser.add_argument("command", choices=["record", "check"])
+    parser.add_argument("--golden", default=GOLDEN_PATH)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        golden = record(args.golden)
+        print(f"recorded {len(golden['environment'])} environment walks, {len(golden['classical']['episodes'])} classical "
+              f"and {len(golden['quantum']['episodes'])} quantum episodes to {args.golden}")
+        return
+
+    results = check(args.golden)
+    for name, ok, detail in results:
+        print(f"{'ok  ' if ok else 'FAIL'} {name}{'  (' + detail + ')' if detail else ''}")
+    failed = sum(not ok for _, ok, _ in results)
+    print(f"{len(results) - failed}/{len(results)} passed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
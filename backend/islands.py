@@ -0,0 +1,92 @@
+import multiprocessing as mp
+import queue
+import random
+from math import pi
+import numpy as np
+from environment import Creature
+from classical_runner import ClassicalRunner
+from evaluation import evaluate_genomes
+from genome import genome_vector, creature_from_vector, make_ga
+from quantum_runner import NUM_ANGLES
+
+# island model: K populations in their own processes, each running the usual mutate/evaluate/select
+# loop, passing their best genomes to the next island in a ring every migration_interval generations
+
+# seconds between checks that every island is still alive while waiting for reports
+POLL_INTERVAL = 1.0
+
+
+def run_island(index, seed, quantum, generations, children, chance, sigma, elites, settings, migration_interval, migrants, inbox, outbox, reports):
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+
+    if quantum:
+        parents = [[random.uniform(-12 * pi, 12 * pi) for _ in range(NUM_ANGLES)] for _ in range(elites)]
+    else:
+        parents = [genome_vector(Creature(model=ClassicalRunner()), False) for _ in range(elites)]
+    opt = make_ga(quantum, parents, children, chance, sigma, elites)
+
+    for gen in range(generations):
+        xs = opt.ask()
+        opt.tell(evaluate_genomes(quantum, list(xs), **settings))
+        elite = list(zip(opt.parents, opt.parent_fitness))
+
+        if migration_interval and (gen + 1) % migration_interval == 0 and gen + 1 < generations:
+            outbox.send(elite[:migrants])
+            incoming = inbox.recv()
+            # migrants replace the worst elites
+            elite = sorted(elite[:max(elites - len(incoming), 0)] + incoming, key=lambda x: x[1], reverse=True)[:elites]
+            opt.parents = np.array([v for v, _ in elite])
+            opt.parent_fitness = [f for _, f in elite]
+
+        reports.put((index, gen, elite[0][0], elite[0][1]))
+
+    reports.put((index, None, None, None))
+
+
+def run_islands(quantum, islands, generations, children, chance, sigma, elites, settings, migration_interval=5, migrants=1, seed=None, stop=None):
+    # yields (gen, creature, fitness) with the best creature over all islands once every island finished gen
+    # raises when an island process dies, setting the stop event (a threading.Event) ends the run early
+    ctx = mp.get_context("spawn")
+    seed = random.randrange(2**32) if seed is None else seed
+    pipes = [ctx.Pipe(duplex=False) for _ in range(islands)]
+    reports = ctx.Queue()
+
+    processes = []
+    for i in range(islands):
+        # island i receives from island i - 1 and sends to island i + 1
+        inbox = pipes[i][0]
+        outbox = pipes[(i + 1) % islands][1]
+        p = ctx.Process(target=run_island, daemon=True,
+                        args=(i, seed + i, quantum, generations, children, chance, sigma, elites, settings, migration_interval, migrants, inbox, outbox, reports))
+        p.start()
+        processes.append(p)
+
+    pending = {}
+    finished = 0
+    next_gen = 0
+    try:
+        while finished < islands:
+            if stop is not None and stop.is_set():
+                return
+            try:
+                index, gen, vector, fit = reports.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                # an island that finished exits with 0 only after its reports are in the queue
+                for i, p in enumerate(processes):
+                    if p.exitcode not in (None, 0):
+                        raise RuntimeError(f"island {i} died with exit code {p.exitcode}")
+                continue
+            if gen is None:
+                finished += 1
+                continue
+            pending.setdefault(gen, []).append((fit, vector))
+            while len(pending.get(next_gen, ())) == islands:
+                fit, vector = max(pending.pop(next_gen), key=lambda x: x[0])
+                yield next_gen, creature_from_vector(vector, quantum), fit
+                next_gen += 1
+    finally:
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+            p.join()
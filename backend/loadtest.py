@@ -0,0 +1,392 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+from math import pi
+import numpy as np
+
+# websocket load generator for /ws/evolution: N clients at once against a uvicorn server, either started here
+# (a localhost subprocess, or in this process) or an already running one given by --url.
+# every client keeps one session open for the whole level, reconnecting when an evolution run finishes:
+#   run     the frontend's evolution payload (RunParams), best messages plus simulation snapshots
+#   genome  a genome run (GenomeParams), a snapshot every frame_interval until the client leaves
+#   mixed   alternating clients of each
+# results are one json file, one entry per client count, so two runs (before and after a server change) can be
+# compared with --compare
+
+# what the frontend sends with its default controls
+RUN_PAYLOAD = {"generations": 20, "children": 10, "chance": 0.2, "sigma": 3, "repeats": 3, "elites": 2, "grid_size": 9,
+               "vision_range": 4, "max_moves": 5, "wall_density": 0.0, "visualize": True}
+GENOME_PAYLOAD = {"run_genome": True, "grid_size": 9, "vision_range": 4, "max_moves": 5, "wall_density": 0.0, "visualize": True}
+
+PERCENTILES = (50, 90, 99)
+
+# the numbers --compare lines up, lower is better for all but the rates
+COMPARE = ["snapshot_rate", "best_rate", "snapshot_interval_ms.p50", "snapshot_interval_ms.p99", "snapshot_late_ms.p99",
+           "connect_ms.p99", "server.cpu_percent.mean", "server.rss_mb.max", "errors"]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30.0, process=None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server did not listen on port {port} within {timeout:.0f}s")
+
+
+def percentiles(values):
+    if not values:
+        return None
+    a = np.asarray(values, dtype=float)
+    summary = {f"p{p}": round(float(np.percentile(a, p)), 2) for p in PERCENTILES}
+    summary["max"] = round(float(a.max()), 2)
+    summary["mean"] = round(float(a.mean()), 2)
+    return summary
+
+
+def genome_text(quantum, rng):
+    # a random genome in the text format of the genome box, built the way the server prints one
+    from classical_runner import ClassicalRunner
+    from environment import Creature
+    from quantum_runner import NUM_ANGLES
+    from web_helpers import create_genome_text
+
+    if quantum:
+        return create_genome_text(Creature([rng.uniform(-12 * pi, 12 * pi) for _ in range(NUM_ANGLES)]), True)
+    return create_genome_text(Creature(model=ClassicalRunner()), False)
+
+
+class ResourceSampler:
+    # cpu percent and resident memory of the server process, sampled every interval seconds
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.cpu = []
+        self.rss = []
+        self.available = True
+        self._stop = None
+
+    async def run(self):
+        try:
+            import psutil
+        except ImportError:
+            self.available = False
+            return
+        process = psutil.Process(self.pid)
+        process.cpu_percent()
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.cpu.append(process.cpu_percent())
+            self.rss.append(process.memory_info().rss / 2**20)
+
+    def start(self):
+        self._stop = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        self._stop.set()
+        await self.task
+        if not self.available:
+            return {"pid": self.pid, "note": "install psutil for cpu and memory"}
+        return {"pid": self.pid, "cpu_percent": percentiles(self.cpu), "rss_mb": percentiles(self.rss)}
+
+
+class ClientStats:
+    def __init__(self, index, scenario):
+        self.index = index
+        self.scenario = scenario
+        self.sessions = 0
+        self.runs_done = 0
+        self.messages = {}
+        self.bytes = 0
+        self.connect_ms = []
+        self.first_message_ms = []
+        self.snapshot_intervals = []
+        self.best_intervals = []
+        self.errors = []
+
+    def count(self, kind, size):
+        self.messages[kind] = self.messages.get(kind, 0) + 1
+        self.bytes += size
+
+    def summary(self):
+        return {"client": self.index, "scenario": self.scenario, "sessions": self.sessions, "runs_done": self.runs_done,
+                "messages": self.messages, "bytes": self.bytes, "errors": self.errors[:5],
+                "snapshot_interval_ms": percentiles(self.snapshot_intervals)}
+
+
+def message_kind(msg):
+    if "error" in msg:
+        return "error"
+    if msg.get("simulation"):
+        return "snapshot"
+    if "best" in msg:
+        return "best"
+    if msg.get("done"):
+        return "done"
+    return "other"
+
+
+async def run_client(url, stats, payload, deadline):
+    import websockets
+
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            async with websockets.connect(url, max_size=None, open_timeout=30) as ws:
+                stats.connect_ms.append((time.perf_counter() - start) * 1000)
+                stats.sessions += 1
+                await ws.send(json.dumps(payload))
+                sent = time.perf_counter()
+                first = True
+                last_snapshot = last_best = None
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return
+                    try:
+                        raw = await asyncio.wait_for(ws.recv(), remaining)
+                    except asyncio.TimeoutError:
+                        return
+                    now = time.perf_counter()
+                    if first:
+                        stats.first_message_ms.append((now - sent) * 1000)
+                        first = False
+                    msg = json.loads(raw)
+                    kind = message_kind(msg)
+                    stats.count(kind, len(raw))
+                    if kind == "snapshot":
+                        if last_snapshot is not None:
+                            stats.snapshot_intervals.append((now - last_snapshot) * 1000)
+                        last_snapshot = now
+                    elif kind == "best":
+                        if last_best is not None:
+                            stats.best_intervals.append((now - last_best) * 1000)
+                        last_best = now
+                    elif kind == "error":
+                        stats.errors.append(msg["error"])
+                        return
+                    elif kind == "done":
+                        stats.runs_done += 1
+                        break
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            stats.errors.append(f"{type(e).__name__}: {e}")
+            await asyncio.sleep(0.5)
+
+
+def client_payload(scenario, index, quantum, frame_interval, genome, overrides):
+    if scenario == "mixed":
+        scenario = "run" if index % 2 == 0 else "genome"
+    if scenario == "run":
+        payload = {**RUN_PAYLOAD, "frame_interval": frame_interval}
+    else:
+        payload = {**GENOME_PAYLOAD, "genome_text": genome, "frame_interval": frame_interval}
+    payload.update(overrides)
+    return scenario, payload
+
+
+async def run_level(base_url, clients, duration, scenario, quantum, frame_interval, ramp, pid, overrides):
+    url = f"{base_url}?quantum={1 if quantum else 0}"
+    genome = genome_text(quantum, random.Random(0)) if scenario != "run" else None
+    sampler = ResourceSampler(pid) if pid is not None else None
+    if sampler is not None:
+        sampler.start()
+
+    start = time.monotonic()
+    deadline = start + duration
+    stats = []
+    tasks = []
+    for i in range(clients):
+        kind, payload = client_payload(scenario, i, quantum, frame_interval, genome, overrides)
+        stats.append(ClientStats(i, kind))
+        tasks.append(asyncio.create_task(run_client(url, stats[-1], payload, deadline)))
+        # spread the connects over the ramp instead of all at once
+        if ramp and i < clients - 1:
+            await asyncio.sleep(ramp / clients)
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - start
+
+    snapshots = [x for s in stats for x in s.snapshot_intervals]
+    messages = {}
+    for s in stats:
+        for kind, n in s.messages.items():
+            messages[kind] = messages.get(kind, 0) + n
+    result = {
+        "clients": clients,
+        "seconds": round(elapsed, 2),
+        "sessions": sum(s.sessions for s in stats),
+        "runs_done": sum(s.runs_done for s in stats),
+        "messages": messages,
+        "message_rate": round(sum(messages.values()) / elapsed, 2),
+        "snapshot_rate": round(messages.get("snapshot", 0) / elapsed, 2),
+        "best_rate": round(messages.get("best", 0) / elapsed, 2),
+        "mb_received": round(sum(s.bytes for s in stats) / 2**20, 3),
+        "snapshot_interval_ms": percentiles(snapshots),
+        # how much later than frame_interval snapshots arrive, the server stretches the interval for slow sockets
+        "snapshot_late_ms": percentiles([max(0.0, x - frame_interval * 1000) for x in snapshots]),
+        "best_interval_ms": percentiles([x for s in stats for x in s.best_intervals]),
+        "connect_ms": percentiles([x for s in stats for x in s.connect_ms]),
+        "first_message_ms": percentiles([x for s in stats for x in s.first_message_ms]),
+        "errors": sum(len(s.errors) for s in stats),
+        "per_client": [s.summary() for s in stats],
+    }
+    if sampler is not None:
+        result["server"] = await sampler.stop()
+    return result
+
+
+def start_subprocess_server(port, workers):
+    backend = os.path.dirname(os.path.abspath(__file__))
+    command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    if workers > 1:
+        command += ["--workers", str(workers)]
+    process = subprocess.Popen(command, cwd=backend)
+    wait_for_port(port, process=process)
+    return process
+
+
+async def start_inprocess_server(port):
+    import uvicorn
+    from main import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+            raise RuntimeError("server stopped during startup")
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+async def run_loadtest(levels, duration, scenario, quantum, frame_interval, ramp, url=None, server="subprocess", server_workers=1, overrides=None, pid=None,
+                       verbose=True):
+    # with url, pid is the running server's process to sample, if known
+    process = inprocess = None
+    if url is None:
+        port = free_port()
+        url = f"ws://127.0.0.1:{port}/ws/evolution"
+        if server == "subprocess":
+            process = await asyncio.to_thread(start_subprocess_server, port, server_workers)
+            pid = process.pid
+        else:
+            # the clients share this process and its event loop, so cpu and memory include them
+            inprocess = await start_inprocess_server(port)
+            pid = os.getpid()
+
+    results = []
+    try:
+        for clients in levels:
+            result = await run_level(url, clients, duration, scenario, quantum, frame_interval, ramp, pid, overrides or {})
+            results.append(result)
+            if verbose:
+                print_level(result)
+    finally:
+        if inprocess is not None:
+            inprocess[0].should_exit = True
+            await inprocess[1]
+        if process is not None:
+            process.terminate()
+            try:
+                await asyncio.to_thread(process.wait, 10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+    return results
+
+
+def lookup(result, path):
+    value = result
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def print_level(result):
+    line = f"{result['clients']:4d} clients: {result['message_rate']:7.1f} msg/s, {result['snapshot_rate']:6.1f} snapshots/s"
+    snap = result["snapshot_interval_ms"]
+    if snap is not None:
+        line += f", snapshot interval p50 {snap['p50']:.0f} ms p99 {snap['p99']:.0f} ms"
+    line += f", {result['errors']} errors"
+    cpu = lookup(result, "server.cpu_percent.mean")
+    if cpu is not None:
+        line += f", server cpu {cpu:.0f}% rss {lookup(result, 'server.rss_mb.max'):.0f} MiB"
+    print(line)
+
+
+def compare(old, new):
+    # side by side numbers of two result files for the client counts both have
+    old_levels = {r["clients"]: r for r in old["levels"]}
+    for result in new["levels"]:
+        before = old_levels.get(result["clients"])
+        if before is None:
+            continue
+        print(f"{result['clients']} clients")
+        for path in COMPARE:
+            a, b = lookup(before, path), lookup(result, path)
+            if a is None or b is None:
+                continue
+            change = f"{(b - a) / a * 100:+.0f}%" if a else ""
+            print(f"  {path:28s} {a:10.1f} {b:10.1f}  {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the /ws/evolution websocket with many concurrent clients")
+    parser.add_argument("--clients", default="1,5,10,20", help="comma separated client counts, one level each")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per level")
+    parser.add_argument("--scenario", choices=["run", "genome", "mixed"], default="mixed")
+    parser.add_argument("--classical", action="store_true", help="classical runs and genomes instead of quantum")
+    parser.add_argument("--frame-interval", type=float, default=0.5)
+    parser.add_argument("--ramp", type=float, default=1.0, help="seconds over which each level's clients connect")
+    parser.add_argument("--payload", default="{}", help="json merged into every payload, e.g. '{\"generations\": 5}'")
+    parser.add_argument("--url", default=None, help="an already running server, e.g. ws://127.0.0.1:8000/ws/evolution (no cpu or memory)")
+    parser.add_argument("--pid", type=int, default=None, help="with --url, the server process to sample cpu and memory from")
+    parser.add_argument("--in-process", action="store_true", help="run uvicorn in this process instead of a subprocess")
+    parser.add_argument("--server-workers", type=int, default=1, help="uvicorn worker processes of the started server")
+    parser.add_argument("--out", default="loadtest.json")
+    parser.add_argument("--compare", default=None, help="an earlier --out file to compare against")
+    args = parser.parse_args()
+
+    levels = [int(x) for x in args.clients.split(",")]
+    config = {"clients": levels, "duration": args.duration, "scenario": args.scenario, "quantum": not args.classical,
+              "frame_interval": args.frame_interval, "ramp": args.ramp, "payload": json.loads(args.payload),
+              "server": args.url or ("in-process" if args.in_process else "subprocess"), "server_workers": args.server_workers}
+
+    results = asyncio.run(run_loadtest(levels, args.duration, args.scenario, not args.classical, args.frame_interval, args.ramp, args.url,
+                                       "in-process" if args.in_process else "subprocess", args.server_workers, config["payload"], args.pid))
+    report = {"config": config, "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+              "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "levels": results}
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=1)
+    print(f"wrote {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,29 @@
 import asyncio
+import math
+import os
 import uvicorn
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List
-from environment import Creature, Environment
+from typing import List, Optional
+import numpy as np
+import engines
+from environment import Creature, Environment, WORLDS
 import web_helpers
-from classical_runner import weights_to_json
-from quantum_runner import serialize_circuit
+from classical_runner import NUM_WEIGHTS
+from quantum_runner import NUM_ANGLES
+from worker import RemoteEvaluator
+from fitness import FITNESS_FUNCTIONS
+from optimizers import OPTIMIZERS
+from recording import EpisodeStore
+from profiling import Profiler, active_profiler
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from pathlib import Path
 
 
 class CreatureSnapshot(BaseModel):
+    # pos is within grid, which is only a window of the world for sparse worlds, starting at origin
     pos: List[int]
     orientation: int
     food_eaten: int
@@ -22,18 +32,23 @@ class CreatureSnapshot(BaseModel):
     generation: int
     energy: int
     max_energy: int
+    origin: List[int] = [0, 0]
+    world_size: int = 0
 
 
 def creature_to_snapshot(creature: Creature, env: Environment, fitness: float, generation: int) -> CreatureSnapshot:
+    (top, left), grid = env.window()
     return CreatureSnapshot(
-        pos=creature.pos,
+        pos=(creature.pos[0] - top, creature.pos[1] - left),
         orientation=creature.orientation,
         food_eaten=creature.food_eaten,
-        grid=env.grid,
+        grid=grid,
         fitness=fitness,
         generation=generation,
         energy=creature.energy,
-        max_energy=creature.max_energy
+        max_energy=creature.max_energy,
+        origin=[top, left],
+        world_size=env.size
     )
 
 
@@ -49,6 +64,27 @@ class RunParams(BaseModel):
     max_moves: int
     wall_density: float
     visualize: bool
+    fitness: str = "default"
+    shots: int = 32
+    adaptive_shots: bool = False
+    min_shots: int = 8
+    max_shots: int = 32
+    optimizer: str = "ga"
+    schedule: str = "generational"
+    workers: int = 0
+    islands: int = 1
+    migration_interval: int = 5
+    remote_workers: List[str] = []
+    profile: bool = False
+    profile_memory: bool = False
+    world: str = "dense"
+    # seconds between simulation snapshots, stretched automatically for slow sockets
+    frame_interval: float = 0.5
+    # evaluate clones once, and optionally mutate them again so every slot is a new genome (generational GA only)
+    dedupe: bool = True
+    resample_clones: bool = False
+    # evaluation engine from engines.py, "auto" picks the fastest for these settings (measured once, then cached on disk)
+    engine: str = "auto"
 
 
 class GenomeParams(BaseModel):
@@ -59,6 +95,42 @@ class GenomeParams(BaseModel):
     max_moves: int
     wall_density: float
     visualize: bool
+    fitness: str = "default"
+    # world seed, the same genome and seed show the same episode, replayed from disk once it was recorded
+    seed: Optional[int] = None
+    replay: bool = True
+    world: str = "dense"
+    frame_interval: float = 0.5
+
+
+class EvaluateParams(BaseModel):
+    genomes: List[str] = []
+    # base64 of back to back little endian genome vectors, all in the mode given by quantum
+    binary: Optional[str] = None
+    quantum: bool = True
+    dtype: str = "float64"
+    repeats: int = 3
+    grid_size: int = 9
+    vision_range: Optional[int] = None
+    max_moves: int = 5
+    wall_density: float = 0.0
+    fitness: str = "default"
+    shots: int = 32
+    world: str = "dense"
+
+
+# bounds of the /evaluate settings, so a single request can't tie up the process pool
+MAX_REPEATS = 1000
+MAX_MOVES = 1000
+MAX_SHOTS = 8192
+# dense worlds hold the whole grid per episode, sparse ones only the blocks the creature sees
+MAX_GRID_SIZE = {"dense": 512, "sparse": 100000}
+
+
+class EvaluateResult(BaseModel):
+    mean: List[float]
+    std: List[float]
+    episodes: int
 
 
 class EvolutionResult(BaseModel):
@@ -67,6 +139,8 @@ class EvolutionResult(BaseModel):
 
 app = FastAPI()
 
+episode_store = EpisodeStore(os.environ.get("EPISODE_DIR", Path(__file__).resolve().parent / "recordings"))
+
 # origins = [
 #     "http://localhost:5173"
 # ]
@@ -87,6 +161,45 @@ def get_creature():
     return creature_to_snapshot(creature, env, 0.0, 0)
 
 
+@app.post("/evaluate", response_model=EvaluateResult)
+async def evaluate(params: EvaluateParams):
+    # fitness statistics over repeats for many genomes at once, for offline tooling
+    if params.fitness not in FITNESS_FUNCTIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown fitness function: {params.fitness}")
+    if params.world not in WORLDS:
+        raise HTTPException(status_code=400, detail=f"Unknown world: {params.world}")
+    if not 1 <= params.repeats <= MAX_REPEATS:
+        raise HTTPException(status_code=400, detail=f"repeats must be between 1 and {MAX_REPEATS}")
+    max_grid = MAX_GRID_SIZE[params.world]
+    if not 3 <= params.grid_size <= max_grid:
+        raise HTTPException(status_code=400, detail=f"grid_size must be between 3 and {max_grid} for the {params.world} world")
+    if params.vision_range is not None and params.vision_range < 1:
+        raise HTTPException(status_code=400, detail="vision_range must be at least 1")
+    if not 1 <= params.max_moves <= MAX_MOVES:
+        raise HTTPException(status_code=400, detail=f"max_moves must be between 1 and {MAX_MOVES}")
+    if not 0 <= params.wall_density < 1:
+        raise HTTPException(status_code=400, detail="wall_density must be at least 0 and below 1")
+    if not 1 <= params.shots <= MAX_SHOTS:
+        raise HTTPException(status_code=400, detail=f"shots must be between 1 and {MAX_SHOTS}")
+    try:
+        genomes = web_helpers.genome_vectors(params.genomes, params.binary, params.quantum, params.dtype)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to parse genomes: {e}")
+
+    settings = {"repeats": params.repeats, "grid_size": params.grid_size, "vision_range": params.vision_range, "max_moves": params.max_moves,
+                "wall_density": params.wall_density, "fitness": params.fitness, "shots": {"shots": params.shots}, "world": params.world}
+    scores = [None] * len(genomes)
+    # quantum and classical genomes go through their own evaluation paths, networks grouped by activation
+    for quantum, activation in dict.fromkeys((q, a) for q, _, a in genomes):
+        indices = [i for i, (q, _, a) in enumerate(genomes) if q == quantum and a == activation]
+        results = await web_helpers.evaluate_scores(quantum, [genomes[i][1] for i in indices], {**settings, "activation": activation})
+        for i, result in zip(indices, results):
+            scores[i] = result
+
+    scores = np.array(scores, dtype=float).reshape(len(genomes), params.repeats)
+    return EvaluateResult(mean=scores.mean(axis=1).tolist(), std=scores.std(axis=1).tolist(), episodes=int(scores.size))
+
+
 @app.websocket("/ws/evolution")
 async def ws_evolution(ws: WebSocket):
     await ws.accept()
@@ -105,22 +218,22 @@ async def ws_evolution(ws: WebSocket):
     sim_stop_event = asyncio.Event()
 
     visualize = False
+    layout_sent = False
 
     async def send_best(generation, creature, fitness):
+        nonlocal layout_sent
         data = {
             "best": {
                 "fitness": fitness,
-                "genome_text": web_helpers.create_genome_text(creature, quantum)
+                "genome_text": web_helpers.payload_cache.genome_text(creature, quantum)
             },
             "generation": generation
         }
 
         if visualize:
-            if quantum:
-                data["best"]["visualization"] = {"circuit": serialize_circuit(creature.angles)}
-            else:
-                weights = creature.model.get_weights()
-                data["best"]["visualization"] = {"network": weights_to_json(weights)}
+            # the circuit / network layout only goes out once per connection, later bests carry just the parameters
+            data["best"]["visualization"] = web_helpers.payload_cache.visualization(creature, quantum, not layout_sent)
+            layout_sent = True
         return await safe_send(data)
 
     async def safe_send(data):
@@ -130,15 +243,18 @@ async def ws_evolution(ws: WebSocket):
         except Exception:
             return False
 
-    async def send_simulation_snapshot(env, holder):
-        snap = creature_to_snapshot(
-            env.player,
-            env,
-            holder["fitness"],
-            holder["generation"],
-        )
+    async def send_simulation_snapshot(frame, holder):
+        # frames are computed ahead by sim_loop, see web_helpers.env_frame
+        snap = CreatureSnapshot(generation=holder["generation"], **frame)
         return await safe_send({"simulation": True, **snap.model_dump()})
 
+    async def report_sim_errors(sim):
+        # sim_loop raises when the simulation fails, the client gets the error instead of a socket without frames
+        try:
+            await sim
+        except Exception as e:
+            await safe_send({"error": f"Simulation failed: {e}"})
+
     def reset_best_simulation():
         current_best["version"] += 1
         sim_stop_event.clear()
@@ -153,6 +269,18 @@ async def ws_evolution(ws: WebSocket):
         # run a genome directly
         if init_payload.get("run_genome") is True:
             params = GenomeParams(**init_payload)
+            if params.fitness not in FITNESS_FUNCTIONS:
+                await safe_send({"error": f"Unknown fitness function: {params.fitness}"})
+                return
+            if params.world not in WORLDS:
+                await safe_send({"error": f"Unknown world: {params.world}"})
+                return
+            if params.seed is not None and params.seed <= 0:
+                await safe_send({"error": "seed must be a positive integer"})
+                return
+            if params.frame_interval <= 0:
+                await safe_send({"error": "frame_interval must be positive"})
+                return
 
             try:
                 genome_mode = web_helpers.read_mode(params.genome_text)
@@ -174,7 +302,9 @@ async def ws_evolution(ws: WebSocket):
             # send initial best so frontend gets genome_text and optionally visualization
             await send_best(0, base, 0.0)
 
-            sim_task = asyncio.create_task(web_helpers.sim_loop(current_best, sim_stop_event, quantum, params.grid_size, params.vision_range, params.max_moves, params.wall_density, send_simulation_snapshot))
+            sim_task = asyncio.create_task(report_sim_errors(web_helpers.sim_loop(current_best, sim_stop_event, quantum, params.grid_size, params.vision_range, params.max_moves, params.wall_density, send_simulation_snapshot, params.fitness,
+                                                                store=episode_store, seed=params.seed, replay=params.replay, world=params.world,
+                                                                frame_interval=params.frame_interval)))
 
             while True:
                 msg = await ws.receive_json()
@@ -187,28 +317,99 @@ async def ws_evolution(ws: WebSocket):
 
         # regular evolution
         params = RunParams(**init_payload)
+        if params.fitness not in FITNESS_FUNCTIONS:
+            await safe_send({"error": f"Unknown fitness function: {params.fitness}"})
+            return
+        if params.optimizer != "ga" and params.optimizer not in OPTIMIZERS:
+            await safe_send({"error": f"Unknown optimizer: {params.optimizer}"})
+            return
+        if params.schedule not in ("generational", "steady_state"):
+            await safe_send({"error": f"Unknown schedule: {params.schedule}"})
+            return
+        if params.world not in WORLDS:
+            await safe_send({"error": f"Unknown world: {params.world}"})
+            return
+        if params.frame_interval <= 0:
+            await safe_send({"error": "frame_interval must be positive"})
+            return
+        if params.shots < 1 or params.min_shots < 1:
+            await safe_send({"error": "shots and min_shots must be at least 1"})
+            return
+        if params.max_shots < params.min_shots:
+            await safe_send({"error": "max_shots must be at least min_shots"})
+            return
+        if params.engine != "auto" and params.engine not in engines.engine_names(quantum):
+            await safe_send({"error": f"Unknown engine: {params.engine}"})
+            return
+        if params.engine not in ("auto", engines.DEFAULT_ENGINES[quantum]) and (params.islands > 1 or params.schedule != "generational" or params.remote_workers):
+            await safe_send({"error": "engine only works with the generational schedule"})
+            return
+        if params.schedule == "steady_state" and params.optimizer != "ga":
+            await safe_send({"error": "the steady_state schedule only works with the ga optimizer"})
+            return
+        if params.schedule == "steady_state" and params.children < 1:
+            await safe_send({"error": "the steady_state schedule needs children of at least 1"})
+            return
+        if params.remote_workers and (params.islands > 1 or params.schedule != "generational"):
+            await safe_send({"error": "remote_workers only work with the generational schedule"})
+            return
+        # ?profile=1 works too, so a slow run can be profiled without changing the frontend payload
+        profile = params.profile or ws.query_params.get("profile", "0").lower() in ("1", "true")
+        if profile and (params.islands > 1 or params.schedule != "generational"):
+            await safe_send({"error": "profile only works with the generational schedule"})
+            return
+        try:
+            remote = RemoteEvaluator(params.remote_workers) if params.remote_workers else None
+        except ValueError as e:
+            await safe_send({"error": f"Invalid remote worker address: {e}"})
+            return
+        profiler = None
+        if profile:
+            profiler = Profiler(memory=params.profile_memory)
+            profiler.start()
+            active_profiler.set(profiler)
+
+        metrics = {}
+        evolution = None
+        try:
+            current_best["auto_restart"] = True
+            sim_task = asyncio.create_task(report_sim_errors(web_helpers.sim_loop(current_best, sim_stop_event, quantum, params.grid_size, params.vision_range, params.max_moves, params.wall_density, send_simulation_snapshot, params.fitness,
+                                                                world=params.world, frame_interval=params.frame_interval)))
+
+            best_fitness = float("-inf")
+            best_final = None
+
+            shots = {"shots": params.shots, "adaptive_shots": params.adaptive_shots, "min_shots": params.min_shots, "max_shots": params.max_shots}
+            engine = None
+            if params.islands == 1 and params.schedule == "generational" and not params.remote_workers:
+                engine = params.engine
+                if engine == "auto":
+                    if params.optimizer == "ga":
+                        population = params.elites * (params.children + 1)
+                    else:
+                        population = 4 + int(3 * math.log(NUM_ANGLES if quantum else NUM_WEIGHTS))
+                    settings = {"repeats": params.repeats, "grid_size": params.grid_size, "vision_range": params.vision_range, "max_moves": params.max_moves,
+                                "wall_density": params.wall_density, "fitness": params.fitness, "shots": shots, "world": params.world}
+                    engine, timings = await asyncio.to_thread(engines.choose_engine, quantum, population, settings)
+                    if timings is not None:
+                        metrics["engine_seconds"] = {k: round(v, 4) for k, v in timings.items()}
+                metrics["engine"] = engine
+            if params.islands > 1:
+                evolution = web_helpers.evolution_islands_async(quantum, params.islands, params.migration_interval, params.generations, params.children, params.chance, params.repeats, params.elites, params.grid_size, params.vision_range, params.max_moves, params.wall_density, params.sigma,
+                                                                params.fitness, shots=shots, metrics=metrics, world=params.world)
+            elif params.schedule == "steady_state":
+                evolution = web_helpers.evolution_steady_async(quantum, params.generations, params.children, params.chance, params.repeats, params.elites, params.grid_size, params.vision_range, params.max_moves, params.wall_density, params.sigma,
+                                                               params.fitness, workers=params.workers, shots=shots, metrics=metrics, world=params.world)
+            elif quantum:
+                evolution = web_helpers.evolution_async(params.generations, params.children, params.chance, params.repeats, params.elites, params.grid_size, params.vision_range, params.max_moves, params.wall_density, params.sigma, params.fitness,
+                                                        shots=params.shots, adaptive_shots=params.adaptive_shots, min_shots=params.min_shots, max_shots=params.max_shots, metrics=metrics, optimizer=params.optimizer, remote=remote, world=params.world,
+                                                        dedupe=params.dedupe, resample_clones=params.resample_clones, engine=engine)
+            else:
+                evolution = web_helpers.evolution_classical_async(params.generations, params.children, params.chance, params.repeats, params.elites, params.grid_size, params.vision_range, params.max_moves, params.wall_density, params.sigma, params.fitness, optimizer=params.optimizer,
+                                                                  remote=remote, metrics=metrics, world=params.world, dedupe=params.dedupe, resample_clones=params.resample_clones,
+                                                                  engine=engine)
 
-        current_best["auto_restart"] = True
-        sim_task = asyncio.create_task(web_helpers.sim_loop(current_best, sim_stop_event, quantum, params.grid_size, params.vision_range, params.max_moves, params.wall_density, send_simulation_snapshot))
-
-        best_fitness = float("-inf")
-        best_final = None
-
-        if quantum:
-            async for gen, creature, fitness in web_helpers.evolution_async(params.generations, params.children, params.chance, params.repeats, params.elites, params.grid_size, params.vision_range, params.max_moves, params.wall_density, params.sigma):
-                if fitness >= best_fitness:
-                    best_fitness = fitness
-                    best_final = (creature, fitness, gen + 1)
-                    ok = await send_best(gen + 1, creature, fitness)
-                    if not ok:
-                        break
-
-                current_best["creature"] = creature
-                current_best["fitness"] = fitness
-                current_best["generation"] = gen + 1
-                current_best["version"] += 1
-        else:
-            async for gen, creature, fitness in web_helpers.evolution_classical_async(params.generations, params.children, params.chance, params.repeats, params.elites, params.grid_size, params.vision_range, params.max_moves, params.wall_density, params.sigma):
+            async for gen, creature, fitness in evolution:
                 if fitness >= best_fitness:
                     best_fitness = fitness
                     best_final = (creature, fitness, gen + 1)
@@ -220,6 +421,16 @@ async def ws_evolution(ws: WebSocket):
                 current_best["fitness"] = fitness
                 current_best["generation"] = gen + 1
                 current_best["version"] += 1
+        finally:
+            # also when the run fails, a profiler left running keeps tracemalloc on for the whole server
+            if evolution is not None:
+                # shuts down the worker pool of a steady state run right away if the socket went away
+                await evolution.aclose()
+            if remote is not None:
+                remote.close()
+            if profiler is not None:
+                active_profiler.set(None)
+                metrics["profile"] = await asyncio.to_thread(profiler.stop)
 
         final_creature, final_fitness, final_gen = best_final
 
@@ -232,7 +443,7 @@ async def ws_evolution(ws: WebSocket):
 
         # Send a final best
         await send_best(final_gen, final_creature, final_fitness)
-        await safe_send({"done": True})
+        await safe_send({"done": True, "metrics": metrics})
 
         # Keep connection open to expect a {"reset_simulation": true}
         while True:
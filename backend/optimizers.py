@@ -0,0 +1,229 @@
+import math
+import random
+import numpy as np
+
+
+class CMAES:
+    # ask/tell CMA-ES over a flat genome vector, maximizing fitness
+    # defaults follow Hansen's "The CMA Evolution Strategy: A Tutorial"; with diagonal=True it is
+    # sep-CMA-ES, which only adapts per coordinate variances and stays cheap for the 724 NN weights
+    def __init__(self, x0, sigma=1.0, popsize=None, diagonal=None, seed=None):
+        self.mean = np.asarray(x0, dtype=float).copy()
+        n = self.n = self.mean.size
+        self.sigma = float(sigma)
+        self.diagonal = n > 100 if diagonal is None else diagonal
+        self.rng = np.random.default_rng(seed)
+
+        self.popsize = popsize or 4 + int(3 * math.log(n))
+        self.mu = self.popsize // 2
+        w = math.log(self.mu + 0.5) - np.log(np.arange(1, self.mu + 1))
+        self.weights = w / w.sum()
+        self.mueff = 1.0 / (self.weights ** 2).sum()
+
+        self.cc = (4 + self.mueff / n) / (n + 4 + 2 * self.mueff / n)
+        self.cs = (self.mueff + 2) / (n + self.mueff + 5)
+        self.c1 = 2 / ((n + 1.3) ** 2 + self.mueff)
+        self.cmu = min(1 - self.c1, 2 * (self.mueff - 2 + 1 / self.mueff) / ((n + 2) ** 2 + self.mueff))
+        if self.diagonal:
+            # sep-CMA learns a diagonal covariance, so it can afford larger learning rates
+            self.c1 = min(1.0, self.c1 * (n + 2) / 3)
+            self.cmu = min(1 - self.c1, self.cmu * (n + 2) / 3)
+        self.damps = 1 + 2 * max(0.0, math.sqrt((self.mueff - 1) / (n + 1)) - 1) + self.cs
+        self.chi_n = math.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n * n))
+
+        self.pc = np.zeros(n)
+        self.ps = np.zeros(n)
+        if self.diagonal:
+            self.C = np.ones(n)
+        else:
+            self.C = np.eye(n)
+            self.B = np.eye(n)
+        self.D = np.ones(n)
+
+        self.generation = 0
+        self.evaluations = 0
+        self.best_x = self.mean.copy()
+        self.best_fitness = -math.inf
+        self._pending = None
+
+    def ask(self):
+        z = self.rng.standard_normal((self.popsize, self.n))
+        y = z * self.D if self.diagonal else (z * self.D) @ self.B.T
+        self._pending = self.mean + self.sigma * y
+        return self._pending.copy()
+
+    def tell(self, fitnesses, solutions=None):
+        xs = self._pending if solutions is None else np.asarray(solutions, dtype=float)
+        f = np.asarray(fitnesses, dtype=float)
+        self.evaluations += len(f)
+        order = np.argsort(-f)
+        if f[order[0]] > self.best_fitness:
+            self.best_fitness = float(f[order[0]])
+            self.best_x = xs[order[0]].copy()
+
+        y = (xs[order[:self.mu]] - self.mean) / self.sigma
+        y_w = self.weights @ y
+        self.mean = self.mean + self.sigma * y_w
+
+        # step size path, uses C^(-1/2) y_w
+        if self.diagonal:
+            c_inv_sqrt_y = y_w / self.D
+        else:
+            c_inv_sqrt_y = self.B @ ((self.B.T @ y_w) / self.D)
+        self.ps = (1 - self.cs) * self.ps + math.sqrt(self.cs * (2 - self.cs) * self.mueff) * c_inv_sqrt_y
+        ps_norm = np.linalg.norm(self.ps)
+        hsig = ps_norm / math.sqrt(1 - (1 - self.cs) ** (2 * (self.generation + 1))) / self.chi_n < 1.4 + 2 / (self.n + 1)
+
+        self.pc = (1 - self.cc) * self.pc + hsig * math.sqrt(self.cc * (2 - self.cc) * self.mueff) * y_w
+
+        # covariance update, rank-one plus rank-mu
+        old = (1 - hsig) * self.cc * (2 - self.cc)
+        if self.diagonal:
+            rank_mu = self.weights @ (y * y)
+            self.C = (1 - self.c1 - self.cmu) * self.C + self.c1 * (self.pc * self.pc + old * self.C) + self.cmu * rank_mu
+            self.D = np.sqrt(self.C)
+        else:
+            rank_mu = (y.T * self.weights) @ y
+            self.C = (1 - self.c1 - self.cmu) * self.C + self.c1 * (np.outer(self.pc, self.pc) + old * self.C) + self.cmu * rank_mu
+            self.C = np.triu(self.C) + np.triu(self.C, 1).T
+            eigvals, self.B = np.linalg.eigh(self.C)
+            self.D = np.sqrt(np.maximum(eigvals, 1e-20))
+
+        self.sigma *= math.exp((self.cs / self.damps) * (ps_norm / self.chi_n - 1))
+        self.generation += 1
+        self._pending = None
+
+
+class GA:
+    # ask/tell version of the genetic algorithm the evolution loops run: every parent gets children mutants,
+    # parents and children are scored together and the best elites are the next parents.
+    # a mutation changes every block of the genome (one angle, one layer of the network) with probability chance,
+    # by uniform noise per coordinate or normal noise over the block. it draws from the global random and np.random
+    # like simulate.mutate and simulate_classical.mutate_classical, so a seeded run breeds the same children
+    def __init__(self, parents, children, chance, sigma, elites=None, blocks=None, noise="uniform", resample_clones=False):
+        self.parents = np.array(parents, dtype=float)
+        self.n = self.parents.shape[1]
+        self.children = children
+        self.chance = chance
+        self.sigma = sigma
+        self.elites = elites or len(self.parents)
+        self.blocks = blocks or [(i, i + 1) for i in range(self.n)]
+        self.noise = noise
+        # a child that is a clone of a genome already in the generation is mutated again (up to 10 times)
+        self.resample_clones = resample_clones
+        self.clones_resampled = 0
+
+        self.parent_fitness = None
+        self.generation = 0
+        self.evaluations = 0
+        self.best_x = self.parents[0].copy()
+        self.best_fitness = -math.inf
+        self._pending = None
+
+    def mutate(self, x):
+        child = x.copy()
+        for start, stop in self.blocks:
+            if random.random() <= self.chance:
+                if self.noise == "uniform":
+                    child[start:stop] += [random.uniform(-self.sigma, self.sigma) for _ in range(start, stop)]
+                else:
+                    child[start:stop] += np.random.normal(0, self.sigma, size=stop - start)
+        return child
+
+    def ask(self):
+        seen = {p.tobytes() for p in self.parents} if self.resample_clones else None
+        population = [self.parents]
+        for p in self.parents:
+            for _ in range(self.children):
+                child = self.mutate(p)
+                if seen is not None:
+                    for _ in range(10):
+                        if child.tobytes() not in seen:
+                            break
+                        child = self.mutate(p)
+                        self.clones_resampled += 1
+                    seen.add(child.tobytes())
+                population.append(child[None])
+        self._pending = np.concatenate(population)
+        return self._pending.copy()
+
+    def tell(self, fitnesses, solutions=None):
+        xs = self._pending if solutions is None else np.asarray(solutions, dtype=float)
+        f = [float(x) for x in fitnesses]
+        self.evaluations += len(f)
+        # stable, so among equal fitness parents stay ahead of their children
+        order = sorted(range(len(f)), key=lambda i: f[i], reverse=True)[:self.elites]
+        if f[order[0]] > self.best_fitness:
+            self.best_fitness = f[order[0]]
+            self.best_x = xs[order[0]].copy()
+        self.parents = xs[order].copy()
+        self.parent_fitness = [f[i] for i in order]
+        self.generation += 1
+        self._pending = None
+
+
+def distinct_rows(xs):
+    # the first row of every distinct genome, and for each row the index of its genome in that array
+    # a clone, e.g. a child none of the mutations touched, shares the fitness of the first row with its genome
+    index = {}
+    unique = []
+    owners = []
+    for i, x in enumerate(xs):
+        key = x.tobytes()
+        if key not in index:
+            index[key] = len(unique)
+            unique.append(i)
+        owners.append(index[key])
+    return xs[unique], np.array(owners, dtype=int)
+
+
+def clone_groups(xs, dedupe):
+    # the rows to evaluate, the owner of every asked row, and the rows grouped by how many times their genome was asked for
+    # a genome asked for k times is evaluated once with k times the repeats, so its clones' episodes are pooled instead of skipped
+    unique, owners = distinct_rows(xs) if dedupe else (xs, np.arange(len(xs)))
+    copies = np.bincount(owners, minlength=len(unique))
+    return unique, owners, [(int(k), np.flatnonzero(copies == k)) for k in np.unique(copies)]
+
+
+def optimize(opt, evaluate, generations, metrics=None, target=None, verbose=True, dedupe=False):
+    # runs an ask/tell optimizer, evaluate(genomes, k) returns the fitness of every row over k times the repeats, serially, batched, in a pool or remotely
+    if metrics is None:
+        metrics = {}
+    metrics.setdefault("evaluations", 0)
+
+    for gen in range(generations):
+        xs = opt.ask()
+        unique, owners, groups = clone_groups(xs, dedupe)
+        fits = np.empty(len(unique))
+        for k, rows in groups:
+            fits[rows] = evaluate(unique[rows], k)
+        fits = fits[owners]
+        metrics["evaluations"] += len(unique)
+        metrics["evaluations_saved"] = metrics.get("evaluations_saved", 0) + len(xs) - len(unique)
+        opt.tell(fits)
+        if getattr(opt, "clones_resampled", 0):
+            metrics["clones_resampled"] = opt.clones_resampled
+
+        if verbose and (gen % 5 == 0 or gen == generations - 1):
+            print(f"gen {gen}: best fitness {fits.max():.1f}, best so far {opt.best_fitness:.1f}, sigma {opt.sigma:.3f}")
+
+        metrics["best_fitness"] = opt.best_fitness
+        if target is not None and opt.best_fitness >= target:
+            metrics["evaluations_to_target"] = metrics["evaluations"]
+            break
+    return opt
+
+
+OPTIMIZERS = {
+    "cmaes": lambda x0, sigma, popsize, seed=None: CMAES(x0, sigma, popsize, seed=seed),
+    "sep-cmaes": lambda x0, sigma, popsize, seed=None: CMAES(x0, sigma, popsize, diagonal=True, seed=seed),
+}
+
+
+def make_optimizer(name, x0, sigma, popsize=None, seed=None):
+    if name not in OPTIMIZERS:
+        raise ValueError(f"Unknown optimizer: {name}")
+    if seed is None:
+        # drawn from np.random, so np.random.seed makes an ES run reproducible like the GA
+        seed = int(np.random.randint(2**32))
+    return OPTIMIZERS[name](x0, sigma, popsize, seed=seed)
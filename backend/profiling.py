@@ -0,0 +1,127 @@
+import asyncio
+import cProfile
+import functools
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextvars import ContextVar
+
+# opt in profiling of evolution runs, nothing here runs unless a run asks for it
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles"))
+
+# profiler of the websocket run the current task belongs to
+active_profiler = ContextVar("active_profiler", default=None)
+
+
+def default_profile_path():
+    return os.path.join(PROFILE_DIR, f"evolution-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{threading.get_ident()}.prof")
+
+
+def function_label(key):
+    filename, line, name = key
+    if filename == "~":
+        return name
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+class Profiler:
+    # one cProfile per profiled call, merged at the end, so calls running in worker threads are covered too
+    def __init__(self, path=None, memory=False, top=15):
+        self.path = path or default_profile_path()
+        self.memory = memory
+        self.top = top
+        self.profiles = []
+        self.lock = threading.Lock()
+        self.started_tracemalloc = False
+        self.start_time = None
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracemalloc = True
+
+    def call(self, fn, *args, **kwargs):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # newer pythons only allow one profiler at a time, e.g. two profiled runs at once
+            return fn(*args, **kwargs)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.disable()
+            with self.lock:
+                self.profiles.append(profile)
+
+    def stop(self):
+        summary = {"file": self.path, "wall_clock": round(time.perf_counter() - self.start_time, 3)}
+
+        if self.memory and tracemalloc.is_tracing():
+            # before building the stats, and without the profiler's own allocations
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, cProfile.__file__), tracemalloc.Filter(False, pstats.__file__),
+                tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)])
+            current, peak = tracemalloc.get_traced_memory()
+            summary["memory"] = {
+                "current_kb": round(current / 1024, 1),
+                "peak_kb": round(peak / 1024, 1),
+                "top": [{"where": f"{os.path.basename(s.traceback[0].filename)}:{s.traceback[0].lineno}", "kb": round(s.size / 1024, 1), "count": s.count}
+                        for s in snapshot.statistics("lineno")[:self.top]],
+            }
+            if self.started_tracemalloc:
+                tracemalloc.stop()
+
+        stats = pstats.Stats(*self.profiles) if self.profiles else pstats.Stats()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        stats.dump_stats(self.path)
+
+        # hottest functions by time spent in the function itself
+        rows = sorted(stats.stats.items(), key=lambda x: x[1][2], reverse=True)[:self.top]
+        summary["top"] = [{"function": function_label(key), "calls": nc, "tottime": round(tt, 4), "cumtime": round(ct, 4)}
+                          for key, (cc, nc, tt, ct, callers) in rows]
+        return summary
+
+
+async def to_thread(fn, *args, **kwargs):
+    # asyncio.to_thread, profiled when the calling run asked for it
+    profiler = active_profiler.get()
+    if profiler is None:
+        return await asyncio.to_thread(fn, *args, **kwargs)
+    return await asyncio.to_thread(profiler.call, fn, *args, **kwargs)
+
+
+def print_summary(summary):
+    print(f"profile written to {summary['file']} ({summary['wall_clock']:.1f}s)")
+    print(f"{'tottime':>9} {'cumtime':>9} {'calls':>9}  function")
+    for row in summary["top"]:
+        print(f"{row['tottime']:9.3f} {row['cumtime']:9.3f} {row['calls']:9d}  {row['function']}")
+    if "memory" in summary:
+        memory = summary["memory"]
+        print(f"memory: {memory['current_kb']:.0f} KiB traced, peak {memory['peak_kb']:.0f} KiB")
+        for row in memory["top"]:
+            print(f"{row['kb']:9.1f} KiB {row['count']:7d}  {row['where']}")
+
+
+def profiled(fn):
+    # adds profile= (True or a .prof path) and profile_memory= to an evolution entry point
+    @functools.wraps(fn)
+    def wrapper(*args, profile=None, profile_memory=False, **kwargs):
+        if not profile:
+            return fn(*args, **kwargs)
+
+        profiler = Profiler(profile if isinstance(profile, str) else None, memory=profile_memory)
+        profiler.start()
+        try:
+            return profiler.call(fn, *args, **kwargs)
+        finally:
+            summary = profiler.stop()
+            if kwargs.get("metrics") is not None:
+                kwargs["metrics"]["profile"] = summary
+            if kwargs.get("verbose", True):
+                print_summary(summary)
+    return wrapper
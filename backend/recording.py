@@ -0,0 +1,158 @@
+import hashlib
+import os
+import random
+import struct
+import numpy as np
+from environment import Creature, Environment
+
+# compact episode recordings, so a creature that was already shown can be replayed without running its controller
+# file layout (little endian):
+#   header  magic "QEP1", grid size, start x, start y, orientation, max energy, steps
+#   grid    size * size int8, the world before the first step
+#   actions steps uint8
+#   events  steps uint8, bit flags below
+HEADER = struct.Struct("<4sHHHBxHI")
+MAGIC = b"QEP1"
+
+MOVED = 1
+ATE = 2
+OUT_OF_ENERGY = 4
+ALL_FOOD_EATEN = 8
+
+# episodes where the creature only turns never run out of energy, those are not worth keeping
+MAX_STEPS = 10000
+
+
+def step_events(env):
+    events = 0
+    if env.moved:
+        events |= MOVED
+    if env.ate:
+        events |= ATE
+    if env.player.energy <= 0:
+        events |= OUT_OF_ENERGY
+    if not env.has_food():
+        events |= ALL_FOOD_EATEN
+    return events
+
+
+class EpisodeRecorder:
+    def __init__(self, env, seed=None):
+        p = env.player
+        self.seed = seed
+        self.size = env.size
+        self.start = (p.pos[0], p.pos[1], p.orientation, p.max_energy)
+        self.grid = np.array(env.grid, dtype=np.int8)
+        self.actions = bytearray()
+        self.events = bytearray()
+
+    def record(self, action, env):
+        self.actions.append(action)
+        self.events.append(step_events(env))
+
+    @property
+    def full(self):
+        return len(self.actions) >= MAX_STEPS
+
+    def to_bytes(self):
+        x, y, orientation, max_energy = self.start
+        header = HEADER.pack(MAGIC, self.size, x, y, orientation, max_energy, len(self.actions))
+        return header + self.grid.tobytes() + bytes(self.actions) + bytes(self.events)
+
+
+class Episode:
+    # views into a memory mapped recording
+    def __init__(self, path):
+        data = np.memmap(path, dtype=np.uint8, mode="r")
+        magic, size, x, y, orientation, max_energy, steps = HEADER.unpack(data[:HEADER.size].tobytes())
+        if magic != MAGIC:
+            raise ValueError(f"Not an episode recording: {path}")
+        offset = HEADER.size
+        self.size = size
+        self.start = (x, y, orientation, max_energy)
+        self.grid = data[offset:offset + size * size].view(np.int8).reshape(size, size)
+        offset += size * size
+        self.actions = data[offset:offset + steps]
+        self.events = data[offset + steps:offset + 2 * steps]
+
+    def __len__(self):
+        return len(self.actions)
+
+    def food_eaten(self):
+        return int(np.count_nonzero(self.events & ATE))
+
+    def environment(self):
+        # the world as it was before the first step, with a controller-less creature in it
+        x, y, orientation, max_energy = self.start
+        # Environment reseeds the global random, which the evolution running next to the replay relies on
+        state = random.getstate()
+        env = Environment(Creature(max_energy=max_energy), s=self.size, max_energy=max_energy)
+        random.setstate(state)
+        env.grid = self.grid.astype(int).tolist()
+        env.food_remaining = int(np.count_nonzero(self.grid == 2))
+        env.player.pos = (x, y)
+        env.player.orientation = orientation
+        return env
+
+
+def episode_key(vector, quantum, grid_size, vision_range, max_moves, wall_density, activation=None):
+    # everything that changes what the creature does, the fitness function is computed again on replay
+    # a linear network keeps the key it had before activations were recorded
+    h = hashlib.sha1(np.asarray(vector, dtype="<f8").tobytes())
+    settings = (bool(quantum), grid_size, vision_range, max_moves, float(wall_density))
+    if activation is not None:
+        settings += (activation,)
+    h.update(repr(settings).encode())
+    return h.hexdigest()[:20]
+
+
+class EpisodeStore:
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key, seed):
+        return os.path.join(self.root, f"{key}_{seed}.ep")
+
+    def find(self, key, seed):
+        path = self.path(key, seed)
+        return path if os.path.exists(path) else None
+
+    def load(self, path):
+        return Episode(path)
+
+    def save(self, key, seed, recorder):
+        os.makedirs(self.root, exist_ok=True)
+        path = self.path(key, seed)
+        # write then rename, so a reader never maps a half written file
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(recorder.to_bytes())
+        os.replace(tmp, path)
+        return path
+
+
+if __name__ == "__main__":
+    import tempfile
+    from math import pi
+    from quantum_runner import DecomposedQuantumRunner, NUM_ANGLES
+    from fitness import episode_fitness
+
+    rng = random.Random(8)
+    runner = DecomposedQuantumRunner(seed=8)
+    c = Creature(angles=[rng.uniform(-12 * pi, 12 * pi) for _ in range(NUM_ANGLES)], max_energy=8)
+    env = Environment(c, s=9, seed=42, max_energy=8, wall_density=0.1)
+    env.generate_food()
+    recorder = EpisodeRecorder(env, 42)
+    while env.player.energy > 0 and env.has_food() and not recorder.full:
+        action = runner.get_action(c.angles, env.get_sight())
+        env.advance(action)
+        recorder.record(action, env)
+
+    store = EpisodeStore(tempfile.mkdtemp())
+    path = store.save("demo", recorder.seed, recorder)
+    episode = store.load(store.find("demo", 42))
+    replay = episode.environment()
+    for action in episode.actions:
+        replay.advance(int(action))
+    print(f"{len(episode)} steps in {os.path.getsize(path)} bytes, food eaten {episode.food_eaten()}")
+    print("live fitness", episode_fitness(env), "replayed fitness", episode_fitness(replay))
@@ -0,0 +1,92 @@
+import numpy as np
+from environment import Creature, Environment, DIRECTIONS
+from fitness import get_fitness
+
+# same offsets as environment.DIRECTIONS, indexed by orientation
+_DIRS = np.array(DIRECTIONS, dtype=np.int64)
+
+
+def build_worlds(seeds, grid_size=9, max_moves=5, wall_density=0.0):
+    # starting grids are generated by the regular Environment so the kernel plays the exact same worlds
+    grids = np.empty((len(seeds), grid_size, grid_size), dtype=np.int8)
+    for i, seed in enumerate(seeds):
+        env = Environment(Creature(), s=grid_size, seed=seed, max_energy=max_moves, wall_density=wall_density)
+        env.generate_food()
+        grids[i] = env.grid
+    return grids
+
+
+def batched_sight(grids, pos, orientation, n):
+    # vectorized Environment.get_sight for every world at once, returns (B, 3) float32
+    b = grids.shape[0]
+    if n <= 0:
+        return np.zeros((b, 3), dtype=np.float32)
+
+    # pad with walls so rays that leave the grid see a wall
+    padded = np.pad(grids, ((0, 0), (n, n), (n, n)), constant_values=3)
+
+    # front, left, right relative to the current orientation
+    dirs = (orientation[:, None] + np.array([0, -1, 1])) % 4
+    offsets = _DIRS[dirs]
+    dist = np.arange(1, n + 1)
+    rows = pos[:, 0, None, None] + n + offsets[:, :, 0, None] * dist
+    cols = pos[:, 1, None, None] + n + offsets[:, :, 1, None] * dist
+    cells = padded[np.arange(b)[:, None, None], rows, cols]
+
+    hit = (cells == 2) | (cells == 3)
+    first = hit.argmax(axis=2)
+    proximity = (n - first) / n
+    kind = np.take_along_axis(cells, first[:, :, None], axis=2)[:, :, 0]
+    sign = np.where(kind == 2, 1.0, -1.0)
+    return np.where(hit.any(axis=2), sign * proximity, 0.0).astype(np.float32)
+
+
+def rollout_classical(population, grids, steps=20, vision_range=None, max_moves=5, fitness="default"):
+    # plays one episode per world, world i with creature i of the PopulationRunner, and returns the fitness of each
+    grids = grids.copy()
+    b, size, _ = grids.shape
+    vr = vision_range if vision_range is not None else size // 2
+    idx = np.arange(b)
+
+    pos = np.full((b, 2), size // 2, dtype=np.int64)
+    orientation = np.zeros(b, dtype=np.int64)
+    energy = np.full(b, max_moves, dtype=np.int64)
+    food_eaten = np.zeros(b, dtype=np.int64)
+    visited = np.zeros((b, size, size), dtype=bool)
+    visited_count = np.zeros(b, dtype=np.int64)
+    age = np.zeros(b, dtype=np.int64)
+    food_total = (grids == 2).sum(axis=(1, 2))
+
+    for _ in range(steps):
+        active = energy > 0
+        if not active.any():
+            break
+
+        age += active
+        actions = population.get_actions(batched_sight(grids, pos, orientation, vr))
+
+        # forward moves
+        new = pos + _DIRS[orientation]
+        inside = ((new >= 0) & (new < size)).all(axis=1)
+        nx = np.clip(new[:, 0], 0, size - 1)
+        ny = np.clip(new[:, 1], 0, size - 1)
+        cell = grids[idx, nx, ny]
+        moves = active & (actions == 1) & inside & (cell != 3)
+
+        ate = moves & (cell == 2)
+        food_eaten += ate
+        energy += 5 * ate
+
+        m = idx[moves]
+        grids[m, pos[moves, 0], pos[moves, 1]] = 0
+        grids[m, nx[moves], ny[moves]] = 1
+        pos[moves] = new[moves]
+        visited_count += moves & ~visited[idx, nx, ny]
+        visited[m, nx[moves], ny[moves]] = True
+        energy[moves] = np.maximum(energy[moves] - 1, 0)
+
+        # turns
+        turn = np.where(actions == 3, 1, 0) - np.where(actions == 2, 1, 0)
+        orientation = np.where(active, (orientation + turn) % 4, orientation)
+
+    return get_fitness(fitness)(food_eaten, food_total - food_eaten, visited_count, energy, age)
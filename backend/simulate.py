@@ -1,37 +1,27 @@
+import argparse
 from environment import *
+from fitness import episode_fitness
+from genome import creature_from_vector, make_ga
+from optimizers import make_optimizer, optimize
+from profiling import profiled
 from quantum_runner import *
 import random
 
 
-def simulate(c, runner, seed=None, steps=20, grid_size=9, vision_range=None, max_moves = 5, wall_density=0.0):
-    env = Environment(c, s=grid_size, seed=seed, max_energy=max_moves, wall_density=wall_density)
+def simulate(c, runner, seed=None, steps=20, grid_size=9, vision_range=None, max_moves = 5, wall_density=0.0, fitness="default", world="dense"):
+    env = get_world(world)(c, s=grid_size, seed=seed, max_energy=max_moves, wall_density=wall_density)
     env.generate_food()
     vr = vision_range if vision_range is not None else grid_size // 2
     for i in range(steps):
         action = runner.get_action(c.angles, env.get_sight(n=vr))
-        _ = env.step(action)
+        env.advance(action)
         if env.player.energy <= 0:
             break
         # print(repr(env))
 
-    # large bonus for clearing all food and more for eating food
-    total_food = c.food_eaten
-    for row in env.grid:
-        for square in row:
-            if square == 2:
-                total_food += 1
-
-    fitness = c.food_eaten * 100 + len(c.visited_positions)
-    if c.food_eaten >= total_food:
-        fitness += 1000
-
-    if c.energy <= 0:
-        fitness -= 50
-    else:
-        fitness += 20
-
+    score = episode_fitness(env, fitness)
     c.reset()
-    return c, fitness
+    return c, score
 
 
 def mutate(creature, chance, sigma=3):
@@ -43,54 +33,87 @@ def mutate(creature, chance, sigma=3):
     return Creature(new_angles)
 
 
-def evaluate_average(c, runner, repeats=3, grid_size=9, vision_range=None, max_moves = 5, wall_density=0.0):
-    total = 0.0
+def evaluate_repeats(c, runner, repeats=3, grid_size=9, vision_range=None, max_moves = 5, wall_density=0.0, fitness="default", world="dense"):
+    scores = []
     for r in range(repeats):
         seed = (hash(tuple(c.angles)) + r) & 0xFFFFFFFF
         # seed = random.randint(0, 9999999)
-        _, f = simulate(c, runner, seed=seed, grid_size=grid_size, vision_range=vision_range, max_moves=max_moves, wall_density=wall_density)
-        total += f
-    return total / repeats
-
-
-def evolution(generations, children, chance, repeats, elites):
-    runner = QuantumRunner()
+        _, f = simulate(c, runner, seed=seed, grid_size=grid_size, vision_range=vision_range, max_moves=max_moves, wall_density=wall_density, fitness=fitness, world=world)
+        scores.append(f)
+    return scores
+
+
+def evaluate_average(c, runner, repeats=3, grid_size=9, vision_range=None, max_moves = 5, wall_density=0.0, fitness="default", world="dense"):
+    return sum(evaluate_repeats(c, runner, repeats, grid_size, vision_range, max_moves, wall_density, fitness, world)) / repeats
+
+
+@profiled
+def evolution(generations, children, chance, repeats, elites, fitness="default", shots=32, adaptive_shots=False, min_shots=8, max_shots=32,
+              optimizer="ga", sigma=3, metrics=None, target=None, verbose=True, islands=1, migration_interval=5, grid_size=9, wall_density=0.0,
+              seed=None, world="dense", dedupe=True, resample_clones=False):
+    runner = DecomposedQuantumRunner(shots=shots, adaptive=adaptive_shots, min_shots=min_shots, max_shots=max_shots, seed=seed)
+    if metrics is None:
+        metrics = {}
+    metrics["evaluations"] = 0
+    metrics["evaluations_saved"] = 0
+
+    if islands > 1:
+        from islands import run_islands
+        settings = {"repeats": repeats, "fitness": fitness, "grid_size": grid_size, "wall_density": wall_density, "world": world,
+                    "shots": {"shots": shots, "adaptive_shots": adaptive_shots, "min_shots": min_shots, "max_shots": max_shots}}
+        best = None
+        for gen, c, f in run_islands(True, islands, generations, children, chance, sigma, elites, settings, migration_interval):
+            metrics["evaluations"] += islands * elites * (children + 1)
+            if best is None or f >= best[1]:
+                best = (c, f)
+            if verbose and (gen % 5 == 0 or gen == generations - 1):
+                print(f"gen {gen}: best fitness over {islands} islands {f:.1f}")
+        metrics["best_fitness"] = best[1]
+        return [list(best[0].angles)]
+
+    if optimizer != "ga":
+        # the ES uses its own default population size (4 + 3 ln n)
+        return evolution_es(generations, None, sigma, repeats, optimizer, fitness, runner, metrics, target, verbose, grid_size, wall_density, world, seed)
 
     # random start
-    parents = []
-    for _ in range(elites):
-        angles = [random.uniform(-12*pi, 12*pi) for _ in range(len(runner.parameters))]
-        parents.append(Creature(angles))
+    parents = [[random.uniform(-12*pi, 12*pi) for _ in range(NUM_ANGLES)] for _ in range(elites)]
+    opt = make_ga(True, parents, children, chance, sigma, elites, resample_clones)
+    optimize(opt, lambda xs, k=1: evaluate_vectors(xs, runner, repeats * k, grid_size, wall_density, fitness, world), generations, metrics, target, verbose, dedupe)
 
-    for gen in range(generations):
-        population = []
+    metrics.update(runner.shot_metrics())
+    if verbose:
+        print(f"{metrics['shots']} shots over {metrics['decisions']} decisions ({metrics['shots_per_decision']:.1f} per decision)")
 
-        for j in range(len(parents)):
-            for _ in range(children):
-                child = mutate(parents[j], chance)
-                population.append(child)
+        print("Final parents:")
+        for p in opt.parents:
+            print(list(p))
 
-        candidates = parents + population
-        cand_with_fit = []
-        for c in candidates:
-            cand_with_fit.append((c, evaluate_average(c, runner, repeats)))
+    # return the angles of the final parents
+    return [[float(x) for x in p] for p in opt.parents]
 
-        cand_with_fit.sort(key=lambda x: x[1], reverse=True)
 
-        if gen % 5 == 0 or gen == generations - 1:
-            print(f"gen {gen}: best fitness {cand_with_fit[0][1]:.1f}, 2nd {cand_with_fit[1][1]:.1f}, 3rd {cand_with_fit[2][1]:.1f}")
+def evaluate_vectors(xs, runner, repeats=3, grid_size=9, wall_density=0.0, fitness="default", world="dense"):
+    # evaluate_average of every angle vector, one after the other
+    return [evaluate_average(creature_from_vector(x, True), runner, repeats, grid_size, wall_density=wall_density, fitness=fitness, world=world) for x in xs]
 
-        parents = [cand_with_fit[j][0] for j in range(min(elites, len(population)))]
 
-        # for child in parents:
-        #     child.normalize_angles()
+def evolution_es(generations, popsize, sigma, repeats, optimizer="cmaes", fitness="default", runner=None, metrics=None, target=None, verbose=True,
+                 grid_size=9, wall_density=0.0, world="dense", seed=None):
+    # evolution strategy over the angle vector, see optimizers.py
+    runner = runner or DecomposedQuantumRunner()
+    if metrics is None:
+        metrics = {}
 
-    print("Final parents:")
-    for p in parents:
-        print(p.angles)
+    x0 = [random.uniform(-12*pi, 12*pi) for _ in range(NUM_ANGLES)]
+    opt = make_optimizer(optimizer, x0, sigma, popsize, seed)
+    optimize(opt, lambda xs, k=1: evaluate_vectors(xs, runner, repeats * k, grid_size, wall_density, fitness, world), generations, metrics, target, verbose)
 
-    # return the angles of the final parents
-    return [list(p.angles) for p in parents]
+    metrics.update(runner.shot_metrics())
+    if verbose:
+        print("Best angles:")
+        print(list(opt.best_x))
+
+    return [[float(x) for x in opt.best_x]]
 
 
 def render(angles, grid_size=9, wall_density=0.0):
@@ -124,6 +147,14 @@ def render(angles, grid_size=9, wall_density=0.0):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", nargs="?", const=True, default=None, help="profile an evolution run instead, optionally into this .prof file")
+    parser.add_argument("--profile-memory", action="store_true", help="also trace allocations with tracemalloc")
+    args = parser.parse_args()
+    if args.profile:
+        evolution(20, 10, 0.2, 3, 5, profile=args.profile, profile_memory=args.profile_memory)
+        raise SystemExit
+
     # evolution(20, 10, 0.2, 3, 5)
 
     angles = [0.49314955464022026, -17.000701033127097, -0.8696918978910082, 7.173013453701259, -10.619195506389651, -25.3888807023303, 16.859678238472217, -16.191769024125808, -30.713596955190308, -30.10772994298271, -32.34004922118576, -7.699319384619486, -30.055116018443517, 12.756593589180547, -18.638222289030637, 19.725279210739103, -9.047420863961793, -11.411062935924665, -31.750835088926884, -40.75576008345652]
@@ -1,38 +1,29 @@
+import argparse
 from environment import *
-from classical_runner import ClassicalRunner
+from fitness import episode_fitness
+from classical_runner import ClassicalRunner, PopulationRunner, unflatten_weights
+from genome import genome_vector, creature_from_vector, make_ga
+from optimizers import make_optimizer, optimize
+from profiling import profiled
+from rollout import build_worlds, rollout_classical
 import random
 import numpy as np
 
 
-def simulate(c, runner, seed=None, steps=20, grid_size=9, vision_range=None, max_moves = 5, wall_density=0.0):
-    env = Environment(c, s=grid_size, seed=seed, max_energy=max_moves, wall_density=wall_density)
+def simulate(c, runner, seed=None, steps=20, grid_size=9, vision_range=None, max_moves = 5, wall_density=0.0, fitness="default", world="dense"):
+    env = get_world(world)(c, s=grid_size, seed=seed, max_energy=max_moves, wall_density=wall_density)
     env.generate_food()
     vr = vision_range if vision_range is not None else grid_size // 2
     for i in range(steps):
         action = runner.get_action(env.get_sight(n=vr))
-        _ = env.step(action)
+        env.advance(action)
         if env.player.energy <= 0:
             break
         # print(repr(env))
 
-    # large bonus for clearing all food and more for eating food
-    total_food = c.food_eaten
-    for row in env.grid:
-        for square in row:
-            if square == 2:
-                total_food += 1
-
-    fitness = c.food_eaten * 100 + len(c.visited_positions)
-    if c.food_eaten >= total_food:
-        fitness += 1000
-
-    if c.energy <= 0:
-        fitness -= 50
-    else:
-        fitness += 20
-
+    score = episode_fitness(env, fitness)
     c.reset()
-    return c, fitness
+    return c, score
 
 
 def mutate_classical(creature, chance, sigma=0.2):
@@ -44,44 +35,104 @@ def mutate_classical(creature, chance, sigma=0.2):
             mutation = np.random.normal(0, sigma, size=w.shape)
             w_new += mutation
         new_weights.append(w_new)
-    return Creature(model=ClassicalRunner(weights=new_weights))
+    return Creature(model=ClassicalRunner(weights=new_weights, activation=creature.model.activation))
 
 
-def evaluate_average(c, runner, repeats=3, grid_size=9, vision_range=None, max_moves = 5, wall_density=0.0):
+def evaluate_average(c, runner, repeats=3, grid_size=9, vision_range=None, max_moves = 5, wall_density=0.0, fitness="default", world="dense"):
     total = 0.0
     for r in range(repeats):
         seed = random.randint(0, 9999999)
-        _, f = simulate(c, runner, seed=seed, grid_size=grid_size, vision_range=vision_range, max_moves=max_moves, wall_density=wall_density)
+        _, f = simulate(c, runner, seed=seed, grid_size=grid_size, vision_range=vision_range, max_moves=max_moves, wall_density=wall_density, fitness=fitness, world=world)
         total += f
     return total / repeats
 
 
-def evolution(generations, children, chance, repeats, elites):
+def population_scores(creatures, repeats=3, grid_size=9, vision_range=None, max_moves=5, wall_density=0.0, steps=20, fitness="default", world="dense"):
+    # every episode of a whole population in one batched rollout, (creatures, repeats)
+    # seeds are drawn in the same order as evaluate_average
+    if world != "dense":
+        # the batched rollout needs dense grids, sparse worlds are simulated one episode at a time
+        scores = [simulate(c, c.model, random.randint(0, 9999999), steps, grid_size, vision_range, max_moves, wall_density, fitness, world)[1]
+                  for c in creatures for _ in range(repeats)]
+        return np.array(scores, dtype=float).reshape(len(creatures), repeats)
+
+    seeds = []
+    grids = []
+    for _ in creatures:
+        for r in range(repeats):
+            seed = random.randint(0, 9999999)
+            seeds.append(seed)
+            # worlds are built one at a time since Environment reseeds the global random
+            grids.append(build_worlds([seed], grid_size, max_moves, wall_density)[0])
+
+    # one row of the population per episode, and one rollout per activation since a population has a single one
+    grids = np.stack(grids)
+    scores = np.empty(len(creatures) * repeats)
+    activations = [c.model.activation for c in creatures]
+    for activation in dict.fromkeys(activations):
+        members = [i for i, a in enumerate(activations) if a == activation]
+        rows = [i * repeats + r for i in members for r in range(repeats)]
+        population = PopulationRunner.from_weight_sets([creatures[i].model.get_weights() for i in members], activation).repeat(repeats)
+        scores[rows] = rollout_classical(population, grids[rows], steps=steps, vision_range=vision_range, max_moves=max_moves, fitness=fitness)
+    return scores.reshape(len(creatures), repeats)
+
+
+def evaluate_population(creatures, repeats=3, grid_size=9, vision_range=None, max_moves=5, wall_density=0.0, steps=20, fitness="default", world="dense"):
+    # evaluate_average for a whole population
+    scores = population_scores(creatures, repeats, grid_size, vision_range, max_moves, wall_density, steps, fitness, world)
+    return (scores.sum(axis=1) / repeats).tolist()
+
+
+@profiled
+def evolution(generations, children, chance, repeats, elites, fitness="default", optimizer="ga", sigma=0.2, metrics=None, target=None, verbose=True,
+              islands=1, migration_interval=5, grid_size=9, wall_density=0.0, world="dense", dedupe=True, resample_clones=False):
+    if metrics is None:
+        metrics = {}
+    metrics["evaluations"] = 0
+    metrics["evaluations_saved"] = 0
+
+    if islands > 1:
+        from islands import run_islands
+        best = None
+        for gen, c, f in run_islands(False, islands, generations, children, chance, sigma, elites, {"repeats": repeats, "fitness": fitness, "grid_size": grid_size, "wall_density": wall_density, "world": world}, migration_interval):
+            metrics["evaluations"] += islands * elites * (children + 1)
+            if best is None or f >= best[1]:
+                best = (c, f)
+            if verbose and (gen % 5 == 0 or gen == generations - 1):
+                print(f"gen {gen}: best fitness over {islands} islands {f:.1f}")
+        metrics["best_fitness"] = best[1]
+        return [best[0].model.get_weights()]
+
+    if optimizer != "ga":
+        # the ES uses its own default population size (4 + 3 ln n)
+        return evolution_es(generations, None, sigma, repeats, optimizer, fitness, metrics, target, verbose, grid_size, wall_density, world)
+
     # random start
-    parents = [Creature(model=ClassicalRunner()) for _ in range(elites)]
+    parents = [genome_vector(Creature(model=ClassicalRunner()), False) for _ in range(elites)]
+    # a layer is only mutated with probability chance, so about a quarter of the children are clones at the default 0.2
+    opt = make_ga(False, parents, children, chance, sigma, elites, resample_clones)
+    optimize(opt, lambda xs, k=1: evaluate_vectors(xs, repeats * k, grid_size, wall_density, fitness, world), generations, metrics, target, verbose, dedupe)
 
-    for gen in range(generations):
-        population = []
+    # return the weights of the final parents
+    return [unflatten_weights(p) for p in opt.parents]
 
-        for j in range(len(parents)):
-            for _ in range(children):
-                child = mutate_classical(parents[j], chance)
-                population.append(child)
 
-        candidates = parents + population
-        cand_with_fit = []
-        for c in candidates:
-            cand_with_fit.append((c, evaluate_average(c, c.model, repeats=repeats)))
+def evaluate_vectors(xs, repeats=3, grid_size=9, wall_density=0.0, fitness="default", world="dense"):
+    # evaluate_population of flattened weight vectors, the whole generation in one batched rollout
+    return evaluate_population([creature_from_vector(x, False) for x in xs], repeats=repeats, grid_size=grid_size, wall_density=wall_density, fitness=fitness, world=world)
 
-        cand_with_fit.sort(key=lambda x: x[1], reverse=True)
 
-        if gen % 5 == 0 or gen == generations - 1:
-            print(f"gen {gen}: best fitness {cand_with_fit[0][1]:.1f}, 2nd {cand_with_fit[1][1]:.1f}, 3rd {cand_with_fit[2][1]:.1f}")
+def evolution_es(generations, popsize, sigma, repeats, optimizer="sep-cmaes", fitness="default", metrics=None, target=None, verbose=True, grid_size=9, wall_density=0.0,
+                 world="dense"):
+    # evolution strategy over the flattened weights, see optimizers.py
+    if metrics is None:
+        metrics = {}
 
-        parents = [cand_with_fit[j][0] for j in range(min(elites, len(population)))]
+    x0 = genome_vector(Creature(model=ClassicalRunner()), False)
+    opt = make_optimizer(optimizer, x0, sigma, popsize)
+    optimize(opt, lambda xs, k=1: evaluate_vectors(xs, repeats * k, grid_size, wall_density, fitness, world), generations, metrics, target, verbose)
 
-    # return the weights of the final parents
-    return [p.model.get_weights() for p in parents]
+    return [unflatten_weights(opt.best_x)]
 
 
 def render(weights, grid_size=9):
@@ -114,7 +165,12 @@ def render(weights, grid_size=9):
 
 
 if __name__ == "__main__":
-    weights = evolution(20, 10, 0.2, 3, 5)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", nargs="?", const=True, default=None, help="profile the evolution run, optionally into this .prof file")
+    parser.add_argument("--profile-memory", action="store_true", help="also trace allocations with tracemalloc")
+    args = parser.parse_args()
+
+    weights = evolution(20, 10, 0.2, 3, 5, profile=args.profile, profile_memory=args.profile_memory)
 
     # save the top weight to a txt file
     file_path = "best_classical_weights.txt"
@@ -0,0 +1,158 @@
+import argparse
+import csv
+import itertools
+import json
+import math
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# headless hyperparameter sweeps over simulate.evolution / simulate_classical.evolution
+#
+# spec file (json):
+# {
+#   "quantum": false,
+#   "search": "grid",                 # or "random"
+#   "samples": 20,                    # random search only
+#   "seed": 0,                        # seed for drawing the random configurations
+#   "seeds": [0, 1, 2],               # every configuration is run once per seed
+#   "fixed": {"generations": 10, "fitness": "default"},
+#   "params": {
+#     "children": [5, 10],            # lists are grid values, or choices for random search
+#     "sigma": {"low": 0.05, "high": 0.5, "log": true}   # ranges are only for random search
+#   }
+# }
+
+DEFAULTS = {"generations": 10, "children": 10, "chance": 0.2, "repeats": 3, "elites": 2}
+
+
+def grid_configs(params):
+    names = list(params)
+    for name in names:
+        if not isinstance(params[name], list):
+            raise ValueError(f"Grid search needs a list of values for {name}")
+    for values in itertools.product(*(params[n] for n in names)):
+        yield dict(zip(names, values))
+
+
+def sample_value(rng, space):
+    if isinstance(space, list):
+        return rng.choice(space)
+    low, high = space["low"], space["high"]
+    if space.get("log"):
+        value = math.exp(rng.uniform(math.log(low), math.log(high)))
+    else:
+        value = rng.uniform(low, high)
+    return round(value) if isinstance(low, int) and isinstance(high, int) else value
+
+
+def random_configs(params, samples, seed=0):
+    rng = random.Random(seed)
+    for _ in range(samples):
+        yield {name: sample_value(rng, space) for name, space in params.items()}
+
+
+def build_trials(spec):
+    params = spec.get("params", {})
+    if spec.get("search", "grid") == "grid":
+        configs = grid_configs(params)
+    elif spec["search"] == "random":
+        configs = random_configs(params, spec.get("samples", 10), spec.get("seed", 0))
+    else:
+        raise ValueError(f"Unknown search: {spec['search']}")
+
+    trials = []
+    for config in configs:
+        for seed in spec.get("seeds", [0]):
+            trials.append((len(trials), {**DEFAULTS, **spec.get("fixed", {}), **config}, seed))
+    return trials
+
+
+def run_trial(quantum, index, config, seed):
+    import simulate
+    import simulate_classical
+
+    random.seed(seed)
+    np.random.seed(seed)
+    metrics = {}
+
+    start = time.perf_counter()
+    # the ES optimizers draw their seed from np.random (see optimizers.make_optimizer)
+    if quantum:
+        # the quantum runner samples from its own generator, so it needs the seed too
+        simulate.evolution(metrics=metrics, verbose=False, seed=seed, **config)
+    else:
+        simulate_classical.evolution(metrics=metrics, verbose=False, **config)
+    elapsed = time.perf_counter() - start
+
+    row = {"trial": index, "seed": seed, **config,
+           "best_fitness": metrics.get("best_fitness"),
+           "evaluations": metrics["evaluations"],
+           "wall_clock": round(elapsed, 3),
+           "evals_per_sec": round(metrics["evaluations"] / elapsed, 2)}
+    if "shots_per_decision" in metrics:
+        row["shots_per_decision"] = round(metrics["shots_per_decision"], 2)
+    return row
+
+
+def run_sweep(spec, workers=None):
+    quantum = bool(spec.get("quantum", False))
+    trials = build_trials(spec)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_trial, quantum, i, config, seed) for i, config, seed in trials]
+        for (i, config, seed), future in zip(trials, futures):
+            # a failing trial becomes a row with the error, the rest of the sweep still runs
+            try:
+                yield future.result()
+            except Exception as e:
+                yield {"trial": i, "seed": seed, **config, "error": f"{type(e).__name__}: {e}"}
+
+
+def write_csv(rows, path):
+    columns = []
+    for row in rows:
+        columns.extend(k for k in row if k not in columns)
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a hyperparameter sweep over the evolution settings")
+    parser.add_argument("spec", help="json sweep spec, see the top of sweep.py")
+    parser.add_argument("--out", default="sweep.csv")
+    parser.add_argument("--workers", type=int, default=None, help="parallel trials (default: one per core)")
+    args = parser.parse_args()
+
+    with open(args.spec) as f:
+        spec = json.load(f)
+
+    rows = []
+    for row in run_sweep(spec, args.workers):
+        rows.append(row)
+        if "error" in row:
+            print(f"trial {row['trial']}: failed, {row['error']}")
+            continue
+        print(f"trial {row['trial']}: best fitness {row['best_fitness']:.1f}, {row['evaluations']} evaluations in {row['wall_clock']:.1f}s "
+              f"({row['evals_per_sec']:.1f}/s)")
+    write_csv(rows, args.out)
+
+    # average over seeds, so the best settings are not just a lucky seed
+    by_config = {}
+    for row in rows:
+        if "error" in row:
+            continue
+        key = tuple((k, v) for k, v in row.items() if k in DEFAULTS or k in spec.get("params", {}))
+        by_config.setdefault(key, []).append(row)
+    ranked = sorted(by_config.items(), key=lambda x: -sum(r["best_fitness"] for r in x[1]) / len(x[1]))
+    print(f"\nwrote {len(rows)} trials to {args.out}, best settings:")
+    for key, group in ranked[:5]:
+        fit = sum(r["best_fitness"] for r in group) / len(group)
+        rate = sum(r["evals_per_sec"] for r in group) / len(group)
+        print(f"  {dict(key)}: mean best fitness {fit:.1f}, {rate:.1f} evals/sec")
+
+
+if __name__ == "__main__":
+    main()
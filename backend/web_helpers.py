@@ -1,69 +1,265 @@
 import asyncio
+import base64
 import random
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import engines
+import profiling
 from math import pi
-from simulate import QuantumRunner, mutate, evaluate_average
-from environment import Creature, Environment
-from simulate_classical import ClassicalRunner, mutate_classical, evaluate_average as evaluate_average_classical
+from simulate import DecomposedQuantumRunner, NUM_ANGLES, mutate, evaluate_average
+from environment import Creature, get_world
+from fitness import episode_fitness
+from simulate_classical import ClassicalRunner, mutate_classical, evaluate_population
+from classical_runner import NUM_WEIGHTS, weights_to_json
+from quantum_runner import serialize_circuit
+from genome import genome_vector, creature_from_vector, make_ga
+from optimizers import make_optimizer, clone_groups
+from evaluation import evaluate_genomes, evaluate_genome_scores
+from islands import run_islands
+from recording import EpisodeRecorder, episode_key
 import numpy as np
 
-async def evolution_async(generations, children, chance, repeats, elites, grid_size, vision_range, max_moves, wall_density, sigma):
-    runner = QuantumRunner()
+def generation_evaluator(quantum, settings, runner=None, remote=None, engine=None, metrics=None):
+    # async evaluate(genomes, k) -> fitnesses over k times the repeats for the drivers below: the worker daemons (see worker.py),
+    # one of the engines in engines.py, or in this process (the runner's angles one creature at a time, the networks in one batched rollout)
+    async def evaluate(genomes, k=1):
+        pooled = settings if k == 1 else {**settings, "repeats": settings["repeats"] * k}
+        inline, _ = engines.split_settings(pooled)
+        if remote is not None:
+            fits = await profiling.to_thread(remote.evaluate, quantum, list(genomes), pooled)
+            if metrics is not None:
+                metrics["remote_retries"] = remote.retries
+            return fits
+        if engine is not None:
+            return await profiling.to_thread(engines.run_engine, engine, quantum, list(genomes), pooled)
+        if not quantum:
+            return await profiling.to_thread(evaluate_population, [creature_from_vector(x, False) for x in genomes], steps=20, **inline)
+        fits = []
+        for x in genomes:
+            fits.append(await profiling.to_thread(evaluate_average, creature_from_vector(x, True), runner, **inline))
+            await asyncio.sleep(0)
+        if metrics is not None:
+            metrics.update(runner.shot_metrics())
+        return fits
 
-    base_angles1 = [random.uniform(-12 * pi, 12 * pi) for _ in range(len(runner.parameters))]
-    base_angles2 = [random.uniform(-12 * pi, 12 * pi) for _ in range(len(runner.parameters))]
-    parents = [Creature(base_angles1), Creature(base_angles2)]
+    return evaluate
 
-    for gen in range(generations):
-        population = []
-        for j in range(len(parents)):
-            for _ in range(children):
-                population.append(mutate(parents[j], chance, sigma=sigma))
 
-        candidates = parents + population
-        cand_with_fit = []
+def count_saved(metrics, saved):
+    # evaluations skipped because the genome was a clone of another candidate
+    if metrics is not None:
+        metrics["evaluations_saved"] = metrics.get("evaluations_saved", 0) + saved
 
-        for c in candidates:
-            fit = await asyncio.to_thread(evaluate_average, c, runner, repeats, grid_size, vision_range, max_moves, wall_density)
-            cand_with_fit.append((c, fit))
-            await asyncio.sleep(0)
 
-        cand_with_fit.sort(key=lambda x: x[1], reverse=True)
+async def optimize_async(opt, quantum, generations, evaluate, metrics=None, dedupe=True, pause=0.0):
+    # drives an ask/tell optimizer (see optimizers.py), yields the best creature and fitness of every generation
+    for gen in range(generations):
+        xs = opt.ask()
+        unique, owners, groups = clone_groups(xs, dedupe)
+        pooled = [0.0] * len(unique)
+        for k, rows in groups:
+            for r, fit in zip(rows, await evaluate(unique[rows], k)):
+                pooled[r] = fit
+        count_saved(metrics, len(xs) - len(unique))
+        fits = [pooled[o] for o in owners]
+        opt.tell(fits)
+        if metrics is not None and getattr(opt, "clones_resampled", 0):
+            metrics["clones_resampled"] = opt.clones_resampled
+
+        best = int(np.argmax(fits))
+        yield gen, creature_from_vector(xs[best], quantum), fits[best]
+        if pause:
+            await asyncio.sleep(pause)
+
+
+def run_settings(repeats, grid_size, vision_range, max_moves, wall_density, fitness, shots, world):
+    return {"repeats": repeats, "grid_size": grid_size, "vision_range": vision_range, "max_moves": max_moves,
+            "wall_density": wall_density, "fitness": fitness, "shots": shots, "world": world}
+
+
+async def evolution_async(generations, children, chance, repeats, elites, grid_size, vision_range, max_moves, wall_density, sigma, fitness="default",
+                          shots=32, adaptive_shots=False, min_shots=8, max_shots=32, metrics=None, optimizer="ga", remote=None, world="dense", dedupe=True,
+                          resample_clones=False, engine=None):
+    runner = DecomposedQuantumRunner(shots=shots, adaptive=adaptive_shots, min_shots=min_shots, max_shots=max_shots)
+    # the decomposed engine runs in this loop, with this runner, so its shot metrics are kept
+    if engine == engines.DEFAULT_ENGINES[True]:
+        engine = None
+
+    if optimizer != "ga":
+        async for item in evolution_es_async(True, generations, None, sigma, repeats, grid_size, vision_range, max_moves, wall_density, optimizer, fitness, runner, metrics, remote, world,
+                                             engine):
+            yield item
+        return
 
-        if gen % 1 == 0 or gen == generations - 1:
-            yield gen, cand_with_fit[0][0], cand_with_fit[0][1]
+    base_angles1 = [random.uniform(-12 * pi, 12 * pi) for _ in range(NUM_ANGLES)]
+    base_angles2 = [random.uniform(-12 * pi, 12 * pi) for _ in range(NUM_ANGLES)]
+    opt = make_ga(True, [base_angles1, base_angles2], children, chance, sigma, elites, resample_clones)
 
-        parents = [cand_with_fit[j][0] for j in range(min(elites, len(cand_with_fit)))]
+    shot_settings = {"shots": shots, "adaptive_shots": adaptive_shots, "min_shots": min_shots, "max_shots": max_shots}
+    settings = run_settings(repeats, grid_size, vision_range, max_moves, wall_density, fitness, shot_settings, world)
+    async for item in optimize_async(opt, True, generations, generation_evaluator(True, settings, runner, remote, engine, metrics), metrics, dedupe):
+        yield item
 
-async def evolution_classical_async(generations, children, chance, repeats, elites, grid_size, vision_range, max_moves, wall_density, sigma):
-    parents = [Creature(model=ClassicalRunner()) for _ in range(elites)]
+async def evolution_classical_async(generations, children, chance, repeats, elites, grid_size, vision_range, max_moves, wall_density, sigma, fitness="default", optimizer="ga",
+                                    remote=None, metrics=None, world="dense", dedupe=True, resample_clones=False, engine=None):
+    if engine == engines.DEFAULT_ENGINES[False]:
+        engine = None
 
-    for gen in range(generations):
-        population = []
-
-        for j in range(len(parents)):
-            for _ in range(children):
-                child = mutate_classical(parents[j], chance, sigma=sigma)
-                population.append(child)
-
-        candidates = parents + population
-        cand_with_fit = []
-        for c in candidates:
-            fit = await asyncio.to_thread(evaluate_average_classical, c, c.model, repeats, grid_size, vision_range, max_moves, wall_density)
-            cand_with_fit.append((c, fit))
-            await asyncio.sleep(0)
+    if optimizer != "ga":
+        async for item in evolution_es_async(False, generations, None, sigma, repeats, grid_size, vision_range, max_moves, wall_density, optimizer, fitness, metrics=metrics, remote=remote, world=world,
+                                             engine=engine):
+            yield item
+        return
 
-        cand_with_fit.sort(key=lambda x: x[1], reverse=True)
+    parents = [genome_vector(Creature(model=ClassicalRunner()), False) for _ in range(elites)]
+    opt = make_ga(False, parents, children, chance, sigma, elites, resample_clones)
 
-        if gen % 1 == 0 or gen == generations - 1:
-            yield gen, cand_with_fit[0][0], cand_with_fit[0][1]
-            # i can't believe i have to do this because it trains too fast
-            await asyncio.sleep(0.5)
+    settings = run_settings(repeats, grid_size, vision_range, max_moves, wall_density, fitness, None, world)
+    # i can't believe i have to do this because it trains too fast
+    async for item in optimize_async(opt, False, generations, generation_evaluator(False, settings, remote=remote, engine=engine, metrics=metrics), metrics, dedupe, pause=0.5):
+        yield item
+
+async def evolution_es_async(quantum, generations, popsize, sigma, repeats, grid_size, vision_range, max_moves, wall_density, optimizer, fitness="default", runner=None, metrics=None,
+                             remote=None, world="dense", engine=None):
+    # ask/tell evolution strategy over the genome vector, yields the best of every generation like the GA
+    if quantum:
+        x0 = [random.uniform(-12 * pi, 12 * pi) for _ in range(NUM_ANGLES)]
+    else:
+        x0 = genome_vector(Creature(model=ClassicalRunner()), False)
+    opt = make_optimizer(optimizer, x0, sigma, popsize)
+
+    shot_settings = {"shots": runner.shots, "adaptive_shots": runner.adaptive, "min_shots": runner.min_shots, "max_shots": runner.max_shots} if runner is not None else None
+    settings = run_settings(repeats, grid_size, vision_range, max_moves, wall_density, fitness, shot_settings, world)
+    # a sample of the ES is never a clone of another
+    async for item in optimize_async(opt, quantum, generations, generation_evaluator(quantum, settings, runner, remote, engine, metrics), metrics, dedupe=False):
+        yield item
+
+
+async def evolution_steady_async(quantum, generations, children, chance, repeats, elites, grid_size, vision_range, max_moves, wall_density, sigma,
+                                 fitness="default", workers=0, shots=None, metrics=None, world="dense"):
+    # steady state evolution: the worker processes keep breeding children from the current elite set and
+    # results are merged as they arrive, so no worker waits for the slowest candidate of a generation.
+    # one "generation" is reported every elites * (children + 1) evaluations, the same count as the GA
+    if children < 1:
+        raise ValueError("steady state evolution needs at least one child per parent")
+    # batches in flight, on the process pool every run and /evaluate share, so many sockets don't start a pool each
+    workers = min(workers or engines.evaluate_workers, engines.evaluate_workers)
+    per_generation = elites * (children + 1)
+    loop = asyncio.get_running_loop()
+    executor = engines.evaluate_pool()
+
+    def random_creature():
+        if quantum:
+            return Creature([random.uniform(-12 * pi, 12 * pi) for _ in range(NUM_ANGLES)])
+        return Creature(model=ClassicalRunner())
+
+    def breed():
+        # children of one elite parent, before the elite set is filled they are fresh random creatures
+        if len(elite) < elites:
+            return [random_creature() for _ in range(children)]
+        parent = random.choice(list(elite.values()))[2]
+        if quantum:
+            kids = [mutate(parent, chance, sigma=sigma) for _ in range(children)]
+        else:
+            kids = [mutate_classical(parent, chance, sigma=sigma) for _ in range(children)]
+        # the parent is scored again with its children, so one lucky noisy score doesn't stay on top for good
+        return [parent] + kids
+
+    def submit(batch):
+        vectors = [genome_vector(c, quantum) for c in batch]
+        future = loop.run_in_executor(executor, evaluate_genomes, quantum, vectors, repeats, grid_size, vision_range, max_moves, wall_density, fitness, shots, world)
+        pending[future] = (batch, vectors)
+
+    def merge(fits, batch, vectors):
+        # an elite's fitness is the mean of all its scores so far
+        for f, c, v in zip(fits, batch, vectors):
+            entry = elite.get(v.tobytes())
+            if entry is None:
+                elite[v.tobytes()] = [f, 1, c]
+            else:
+                entry[0] += f
+                entry[1] += 1
+        ranked = sorted(elite.items(), key=lambda x: x[1][0] / x[1][1], reverse=True)[:elites]
+        elite.clear()
+        elite.update(ranked)
+
+    # genome bytes -> [sum of scores, number of scores, creature], best first
+    elite = {}
+    pending = {}
+    evaluations = 0
+    gen = 0
+
+    try:
+        for _ in range(workers):
+            submit(breed())
+
+        while gen < generations:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                batch, vectors = pending.pop(future)
+                merge(future.result(), batch, vectors)
+                evaluations += len(batch)
+                submit(breed())
+
+            if metrics is not None:
+                metrics["evaluations"] = evaluations
+                metrics["workers"] = workers
+
+            while evaluations >= (gen + 1) * per_generation and gen < generations:
+                total, count, best = next(iter(elite.values()))
+                yield gen, best, total / count
+                gen += 1
+    finally:
+        # the pool is shared, only this run's batches are dropped
+        for future in pending:
+            future.cancel()
+
+
+async def evolution_islands_async(quantum, islands, migration_interval, generations, children, chance, repeats, elites, grid_size, vision_range, max_moves, wall_density, sigma,
+                                  fitness="default", shots=None, metrics=None, world="dense"):
+    # island model run (see islands.py). the blocking report queue is read by a thread of its own that owns the
+    # generator, closing this run sets stop and the thread then terminates the island processes
+    settings = run_settings(repeats, grid_size, vision_range, max_moves, wall_density, fitness, shots, world)
+    loop = asyncio.get_running_loop()
+    items = asyncio.Queue()
+    stop = threading.Event()
+
+    def post(item):
+        try:
+            loop.call_soon_threadsafe(items.put_nowait, item)
+        except RuntimeError:
+            # the event loop is gone already
+            pass
+
+    def read():
+        try:
+            for item in run_islands(quantum, islands, generations, children, chance, sigma, elites, settings, migration_interval, stop=stop):
+                post(item)
+        except Exception as e:
+            post(e)
+        post(None)
+
+    threading.Thread(target=read, daemon=True).start()
+    try:
+        while True:
+            item = await items.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            if metrics is not None:
+                metrics["islands"] = islands
+                metrics["evaluations"] = (item[0] + 1) * islands * elites * (children + 1)
+            yield item
+    finally:
+        stop.set()
 
-        parents = [cand_with_fit[j][0] for j in range(min(elites, len(population)))]
 
 def clone_creature_for_run(base, quantum):
     if quantum:
-        runner = QuantumRunner()
+        runner = DecomposedQuantumRunner()
         angles = base.angles
         fresh = Creature(angles=angles, max_energy=base.max_energy)
         return fresh, runner
@@ -74,71 +270,155 @@ def clone_creature_for_run(base, quantum):
     return fresh, runner
 
 
-async def sim_loop(current_best, sim_stop_event, quantum, grid_size, vision_range, max_moves, wall_density, on_snapshot):
-    last_version = -1
+# visualization episodes are stepped in worker threads, SIM_CHUNK steps at a time, into a buffer of at most SIM_BUFFER frames
+# the threads are shared by every viewer, so more viewers don't mean more threads fighting the event loop for the GIL
+SIM_CHUNK = 8
+SIM_BUFFER = 16
+SIM_THREADS = 2
+_sim_executor = ThreadPoolExecutor(max_workers=SIM_THREADS, thread_name_prefix="sim")
+# a socket that takes long to send a frame gets frames less often, up to this interval
+MAX_FRAME_INTERVAL = 5.0
+
+
+def env_frame(env, fitness):
+    # everything a snapshot needs, copied so the environment can keep stepping ahead of playback
+    (top, left), grid = env.window()
+    p = env.player
+    return {"pos": [p.pos[0] - top, p.pos[1] - left], "orientation": p.orientation, "food_eaten": p.food_eaten, "grid": [list(row) for row in grid],
+            "fitness": fitness, "energy": p.energy, "max_energy": p.max_energy, "origin": [top, left], "world_size": env.size}
+
+
+async def sim_loop(current_best, sim_stop_event, quantum, grid_size, vision_range, max_moves, wall_density, on_snapshot, fitness="default",
+                   store=None, seed=None, replay=True, world="dense", frame_interval=0.5):
+    # with an EpisodeStore, episodes are recorded, and replayed instead of simulated when a recording exists
+    # recordings keep the whole starting grid, so sparse worlds are always simulated live
+    if world != "dense":
+        store = None
     env = None
     runner = None
+    recorder = None
+    actions = None
+    key = None
+    frames = asyncio.Queue(maxsize=SIM_BUFFER)
+
+    def start_episode(base):
+        nonlocal env, runner, recorder, actions, key
+        recorder = actions = None
+        if store is not None:
+            key = episode_key(genome_vector(base, quantum), quantum, grid_size, vision_range, max_moves, wall_density,
+                              None if quantum else base.model.activation)
+            # only a world picked with seed is replayed, without one every episode gets a new random world
+            path = store.find(key, seed) if replay and seed is not None else None
+            if path is not None:
+                episode = store.load(path)
+                actions = iter(episode.actions.tolist())
+                env, runner = episode.environment(), None
+                return
+
+        episode_seed = seed
+        if store is not None and episode_seed is None:
+            episode_seed = random.randint(1, 9999999)
+        fresh, runner = clone_creature_for_run(base, quantum)
+        env = get_world(world)(fresh, s=grid_size, seed=episode_seed, max_energy=max_moves, wall_density=wall_density)
+        env.generate_food()
+        if store is not None:
+            recorder = EpisodeRecorder(env, episode_seed)
+
+    def finish_episode():
+        if recorder is not None:
+            store.save(key, recorder.seed, recorder)
+
+    def run_steps(n):
+        # up to n steps of the current episode, in a worker thread so the controller never blocks the event loop
+        nonlocal recorder
+        out = []
+        for _ in range(n):
+            if actions is not None:
+                # recorded episode, no controller to run
+                action = next(actions, 0)
+            else:
+                vision = env.get_sight(vision_range)
+
+                if quantum:
+                    action = runner.get_action(env.player.angles, vision)
+                else:
+                    action = runner.get_action(vision)
 
+            env.step(action)
+
+            if recorder is not None:
+                recorder.record(action, env)
+                if recorder.full:
+                    recorder = None
+
+            ended = env.player.energy <= 0 or not env.has_food()
+            out.append((env_frame(env, episode_fitness(env, fitness)), ended))
+            if ended:
+                finish_episode()
+                break
+        return out
+
+    async def produce():
+        version = None
+        ended = False
+        try:
+            while True:
+                holder = current_best
+                if holder.get("creature") is None:
+                    await asyncio.sleep(0.1)
+                    continue
+
+                if holder.get("version") != version:
+                    # print("(re)starting simulation for gen", holder.get("generation"))
+                    version = holder.get("version")
+                    base = holder["creature"]
+                    await loop.run_in_executor(_sim_executor, start_episode, base)
+                elif ended:
+                    if not holder["auto_restart"]:
+                        # wait for a new best or a reset
+                        await asyncio.sleep(0.1)
+                        continue
+                    await loop.run_in_executor(_sim_executor, start_episode, base)
+
+                for frame, ended in await loop.run_in_executor(_sim_executor, run_steps, SIM_CHUNK):
+                    await frames.put((version, frame, ended))
+        except Exception as e:
+            # a failed controller or environment goes to the consumer, which would otherwise wait for frames forever
+            await frames.put((None, e, True))
+
+    loop = asyncio.get_running_loop()
+    producer = asyncio.create_task(produce())
+    interval = frame_interval
     try:
         while True:
             if sim_stop_event.is_set():
                 await asyncio.sleep(0.1)
                 continue
 
-            holder = current_best
-            if holder.get("creature") is None:
-                await asyncio.sleep(0.1)
+            version, frame, ended = await frames.get()
+            if isinstance(frame, Exception):
+                sim_stop_event.set()
+                raise frame
+            if version != current_best.get("version"):
+                # stepped ahead for a creature that is no longer shown
                 continue
 
-            if holder.get("version") != last_version:
-                # print("(re)starting simulation for gen", holder.get("generation"))
-                last_version = holder.get("version")
+            start = loop.time()
+            await on_snapshot(frame, current_best)
+            sent = loop.time() - start
+            # slow sends (many viewers, slow clients) stretch the interval instead of queueing up frames
+            interval = min(MAX_FRAME_INTERVAL, max(frame_interval, 2 * sent, 0.9 * interval))
 
-                base = holder["creature"]
-
-                fresh, runner = clone_creature_for_run(base, quantum)
-                env = Environment(fresh, s=grid_size, max_energy=max_moves, wall_density=wall_density)
-                env.generate_food()
-
-            vision = env.get_sight(vision_range)
-
-            if quantum:
-                action = runner.get_action(env.player.angles, vision)
-            else:
-                action = runner.get_action(vision)
-
-            env.step(action)
-
-            holder["fitness"] = compute_fitness(env.player, env)
-
-            await on_snapshot(env, holder)
-
-            if env.player.energy <= 0:
-                # print("No energy, simulation done")
-                if not holder["auto_restart"]:
-                    # print("stopping simulation")
-                    sim_stop_event.set()
-                else:
-                    fresh, runner = clone_creature_for_run(base, quantum)
-                    env = Environment(fresh, s=grid_size, max_energy=max_moves, wall_density=wall_density)
-                    env.generate_food()
-                holder["fitness"] = compute_fitness(env.player, env)
-                await on_snapshot(env, holder)
+            if ended and not current_best["auto_restart"]:
+                # print("simulation done, stopping")
+                sim_stop_event.set()
                 continue
 
-            await asyncio.sleep(0.5)
-            if not env.has_food():
-                # print("All food eaten, simulation done")
-                if not holder["auto_restart"]:
-                    # print("stopping simulation")
-                    sim_stop_event.set()
-                else:
-                    fresh, runner = clone_creature_for_run(base, quantum)
-                    env = Environment(fresh, s=grid_size, max_energy=max_moves, wall_density=wall_density)
-                    env.generate_food()
-                holder["fitness"] = compute_fitness(env.player, env)
+            await asyncio.sleep(max(0.0, interval - sent))
     except asyncio.CancelledError:
         return
+    finally:
+        producer.cancel()
 
 
 def create_genome_text(c: Creature, quantum):
@@ -149,6 +429,9 @@ def create_genome_text(c: Creature, quantum):
     weights = c.model.get_weights()
 
     out_lines = ["classical"]
+    # linear networks keep the original format
+    if c.model.activation is not None:
+        out_lines.append(f"activation: {c.model.activation}")
     for layer_weights in weights:
         arr = np.array(layer_weights)
         if arr.ndim == 1:
@@ -161,6 +444,52 @@ def create_genome_text(c: Creature, quantum):
     return "\n".join(out_lines)
 
 
+def visualization_payload(creature, quantum, full):
+    # full sends the whole circuit / network, otherwise only its parameters, for a client that already has the layout
+    if quantum:
+        if full:
+            return {"circuit": serialize_circuit(creature.angles)}
+        return {"circuit_params": np.round(np.asarray(creature.angles[:NUM_ANGLES], dtype=float), 2).tolist()}
+
+    weights = creature.model.get_weights()
+    if full:
+        return {"network": weights_to_json(weights)}
+    return {"network_weights": [np.round(np.asarray(w, dtype=float), 2).tolist() for w in weights]}
+
+
+class PayloadCache:
+    # genome text and visualization payloads per genome, the same best is often sent again (final best, other viewers)
+    def __init__(self, size=128):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def entry(self, creature, quantum):
+        # the vector only holds weights, the activation goes in the genome text too
+        key = (bool(quantum), None if quantum else creature.model.activation, genome_vector(creature, quantum).tobytes())
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = {"genome_text": create_genome_text(creature, quantum)}
+            self.entries[key] = entry
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        else:
+            self.entries.move_to_end(key)
+        return entry
+
+    def genome_text(self, creature, quantum):
+        return self.entry(creature, quantum)["genome_text"]
+
+    def visualization(self, creature, quantum, full):
+        entry = self.entry(creature, quantum)
+        name = "layout" if full else "params"
+        if name not in entry:
+            entry[name] = visualization_payload(creature, quantum, full)
+        return entry[name]
+
+
+payload_cache = PayloadCache()
+
+
 def read_mode(genome):
     for line in genome.splitlines():
         line = line.strip()
@@ -192,11 +521,15 @@ def creature_from_genome_text(genome, max_energy):
     if mode == "quantum":
         numbers = lines[0]
         angles = [float(x) for x in numbers.split(",")]
-        runner = QuantumRunner()
-        if len(angles) != len(runner.parameters):
-            raise ValueError(f"Invalid number of angles for quantum runner: expected {len(runner.parameters)}, got {len(angles)}")
+        if len(angles) != NUM_ANGLES:
+            raise ValueError(f"Invalid number of angles for quantum runner: expected {NUM_ANGLES}, got {len(angles)}")
         return Creature(angles=angles, max_energy=max_energy)
 
+    activation = None
+    if lines and lines[0].startswith("activation:"):
+        activation = lines[0].split(":", 1)[1].strip()
+        lines = lines[1:]
+
     weights = []
     current_weight = []
     for line in lines:
@@ -218,28 +551,48 @@ def creature_from_genome_text(genome, max_energy):
         weights.append(arr)
 
     try:
-        runner = ClassicalRunner(weights=weights)
+        runner = ClassicalRunner(weights=weights, activation=activation)
     except Exception as e:
         raise ValueError(f"Failed to create ClassicalRunner from weights: {e}")
 
     return Creature(model=runner, max_energy=max_energy)
 
 
-def compute_fitness(creature, env):
-    total_food = creature.food_eaten
-    for row in env.grid:
-        for square in row:
-            if square == 2:
-                total_food += 1
-
-    fitness = creature.food_eaten * 100 + len(creature.visited_positions)
-
-    if creature.food_eaten >= total_food:
-        fitness += 1000
-
-    if creature.energy <= 0:
-        fitness -= 50
-    else:
-        fitness += 20
-
-    return fitness
+def genome_vectors(genomes, binary=None, quantum=True, dtype="float64"):
+    # text genomes (see create_genome_text) and/or base64 of back to back little endian genome vectors
+    # returns (quantum, vector, activation) in order, text genomes first, binary networks are linear
+    out = []
+    for text in genomes:
+        quantum_text = read_mode(text) == "quantum"
+        c = creature_from_genome_text(text, max_energy=5)
+        vector = genome_vector(c, quantum_text)
+        if not quantum_text and vector.size != NUM_WEIGHTS:
+            raise ValueError(f"Invalid number of weights for classical runner: expected {NUM_WEIGHTS}, got {vector.size}")
+        out.append((quantum_text, vector, None if quantum_text else c.model.activation))
+
+    if binary:
+        if dtype not in ("float32", "float64"):
+            raise ValueError(f"Invalid dtype: {dtype}")
+        data = np.frombuffer(base64.b64decode(binary), dtype=np.dtype(dtype).newbyteorder("<"))
+        size = NUM_ANGLES if quantum else NUM_WEIGHTS
+        if data.size % size:
+            raise ValueError(f"Binary genomes must be a multiple of {size} values, got {data.size}")
+        out.extend((quantum, v, None) for v in data.astype(float).reshape(-1, size))
+    for i, (_, vector, _) in enumerate(out):
+        if not np.isfinite(vector).all():
+            raise ValueError(f"Genome {i} has NaN or infinite values")
+    return out
+
+
+async def evaluate_scores(quantum, vectors, settings, min_chunk=64):
+    # per repeat scores of every genome, split over the process pool in chunks
+    if not vectors:
+        return []
+    loop = asyncio.get_running_loop()
+    chunk = max(min_chunk, -(-len(vectors) // engines.evaluate_workers))
+    futures = [loop.run_in_executor(engines.evaluate_pool(), partial(evaluate_genome_scores, quantum, vectors[i:i + chunk], **settings))
+               for i in range(0, len(vectors), chunk)]
+    results = []
+    for part in await asyncio.gather(*futures):
+        results.extend(part)
+    return results
@@ -0,0 +1,227 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from evaluation import evaluate_genomes
+
+# evaluation worker daemon and the client that fans batches out to several of them.
+# messages are 4 byte big endian length + JSON:
+#   request  {"quantum": bool, "genomes": [[float, ...], ...], "settings": {...evaluate_genomes kwargs}}
+#   response {"fitness": [float, ...]} or {"error": str}
+
+HEADER = struct.Struct(">I")
+
+
+def encode_message(data):
+    body = json.dumps(data).encode()
+    return HEADER.pack(len(body)) + body
+
+
+def recv_exactly(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("worker closed the connection")
+        buf += chunk
+    return bytes(buf)
+
+
+def recv_message(sock):
+    (size,) = HEADER.unpack(recv_exactly(sock, HEADER.size))
+    return json.loads(recv_exactly(sock, size))
+
+
+async def handle_client(reader, writer):
+    try:
+        while True:
+            try:
+                (size,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+                request = json.loads(await reader.readexactly(size))
+            except asyncio.IncompleteReadError:
+                break
+
+            try:
+                fitness = await asyncio.to_thread(evaluate_genomes, bool(request["quantum"]), request["genomes"], **request.get("settings", {}))
+                response = {"fitness": [float(f) for f in fitness]}
+            except Exception as e:
+                response = {"error": f"{type(e).__name__}: {e}"}
+
+            writer.write(encode_message(response))
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+async def serve(host, port):
+    server = await asyncio.start_server(handle_client, host, port)
+    print(f"evaluation worker listening on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+class RemoteEvaluator:
+    # splits a batch of genomes over the workers and retries the chunks of workers that fail on the others.
+    # a worker that can't be reached or drops the connection is left out from then on, one that is only slow
+    # (no answer within timeout + seconds_per_genome per genome of its chunk) keeps its place and the chunk is
+    # sent again, up to max_timeouts times per batch
+    def __init__(self, addresses, timeout=60.0, seconds_per_genome=1.0, connect_timeout=10.0, max_timeouts=3):
+        if not addresses:
+            raise ValueError("RemoteEvaluator needs at least one worker address")
+        self.addresses = [parse_address(a) if isinstance(a, str) else a for a in addresses]
+        self.timeout = timeout
+        self.seconds_per_genome = seconds_per_genome
+        self.connect_timeout = connect_timeout
+        self.max_timeouts = max_timeouts
+        self.pool = ThreadPoolExecutor(max_workers=len(self.addresses))
+        self.retries = 0
+
+    def _request(self, address, quantum, genomes, settings):
+        try:
+            sock = socket.create_connection(address, timeout=self.connect_timeout)
+        except OSError as e:
+            # refused, unreachable or no answer to the connect, the worker is gone
+            raise ConnectionError(f"cannot reach worker {address[0]}:{address[1]}: {e}") from e
+        with sock:
+            sock.settimeout(self.timeout + self.seconds_per_genome * len(genomes))
+            sock.sendall(encode_message({"quantum": quantum, "genomes": genomes, "settings": settings}))
+            response = recv_message(sock)
+        if "error" in response:
+            # the worker is fine, the request is not, so this is not retried
+            raise ValueError(f"worker {address[0]}:{address[1]} failed: {response['error']}")
+        return response["fitness"]
+
+    def evaluate(self, quantum, genomes, settings):
+        genomes = [[float(x) for x in g] for g in genomes]
+        results = [None] * len(genomes)
+        alive = list(self.addresses)
+        # (start, end) ranges still to evaluate
+        todo = [(0, len(genomes))]
+        timeouts = 0
+
+        while todo:
+            if not alive:
+                raise RuntimeError("all evaluation workers are unreachable")
+            # spread the remaining ranges evenly over the workers that are still alive
+            chunks = []
+            for start, end in todo:
+                step = max(1, -(-(end - start) // len(alive)))
+                chunks.extend((s, min(s + step, end)) for s in range(start, end, step))
+            todo = []
+
+            futures = {}
+            for i, (start, end) in enumerate(chunks):
+                address = alive[i % len(alive)]
+                futures[self.pool.submit(self._request, address, quantum, genomes[start:end], settings)] = (address, start, end)
+
+            for future, (address, start, end) in futures.items():
+                try:
+                    results[start:end] = future.result()
+                except TimeoutError:
+                    # slow, not dead, the chunk goes out again with the worker still in the set
+                    timeouts += 1
+                    if timeouts > self.max_timeouts:
+                        raise RuntimeError(f"evaluation workers timed out {timeouts} times on one batch")
+                    self.retries += 1
+                    todo.append((start, end))
+                except OSError:
+                    if address in alive:
+                        alive.remove(address)
+                    self.retries += 1
+                    todo.append((start, end))
+        return results
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+
+
+def start_local_worker():
+    # a worker daemon in a subprocess on a free localhost port
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--port", str(port)], stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return process, ("127.0.0.1", port)
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("local worker did not start")
+
+
+def check_localhost():
+    # the failure handling of RemoteEvaluator against real worker processes on this machine
+    import numpy as np
+
+    settings = {"repeats": 2, "grid_size": 9, "max_moves": 5, "wall_density": 0.1}
+    genomes = np.random.default_rng(0).uniform(-10, 10, size=(24, 20))
+    workers = [start_local_worker() for _ in range(2)]
+    try:
+        addresses = [address for _, address in workers]
+        remote = RemoteEvaluator(addresses)
+        fits = remote.evaluate(True, genomes, settings)
+        assert len(fits) == len(genomes) and remote.retries == 0
+        print(f"two workers: {len(fits)} genomes, no retries")
+
+        # a worker that is gone is left out, its chunk is evaluated by the other one
+        workers[1][0].kill()
+        workers[1][0].wait()
+        fits = remote.evaluate(True, genomes, settings)
+        assert len(fits) == len(genomes) and remote.retries == 1
+        print(f"one worker killed: {len(fits)} genomes, {remote.retries} retry")
+        remote.close()
+
+        # a slow worker is not dropped, its chunk is retried until max_timeouts
+        slow = RemoteEvaluator(addresses[:1], timeout=0.001, seconds_per_genome=0.0, max_timeouts=2)
+        try:
+            slow.evaluate(True, genomes, {**settings, "repeats": 20})
+            raise AssertionError("expected the timeouts to fail the batch")
+        except RuntimeError as e:
+            assert "timed out" in str(e) and slow.retries == 2, e
+            print(f"slow worker: {slow.retries} retries on the same worker, then \"{e}\"")
+        slow.close()
+
+        # the same batch with a timeout sized for it
+        fits = RemoteEvaluator(addresses[:1]).evaluate(True, genomes, {**settings, "repeats": 20})
+        assert len(fits) == len(genomes)
+        print("slow batch with the default timeout: ok")
+
+        try:
+            RemoteEvaluator(addresses[1:]).evaluate(True, genomes, settings)
+            raise AssertionError("expected no reachable workers")
+        except RuntimeError as e:
+            print(f"no worker left: \"{e}\"")
+    finally:
+        for process, _ in workers:
+            process.kill()
+            process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run an evaluation worker")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--check", action="store_true", help="instead, check RemoteEvaluator against local worker processes")
+    args = parser.parse_args()
+    if args.check:
+        check_localhost()
+        return
+    asyncio.run(serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
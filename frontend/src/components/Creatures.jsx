@@ -5,6 +5,23 @@ import NeuralNetView from './NeuralNetView.jsx';
 
 const CELL_SIZE = 40;
 
+// only the first best of a run carries the circuit / network layout, later ones just the parameters
+function applyVisualization(prev, visualization) {
+	if (visualization.circuit || visualization.network) {
+		return visualization;
+	}
+	if (visualization.circuit_params && prev && prev.circuit) {
+		let i = 0;
+		const gates = prev.circuit.gates.map((gate) => (typeof gate.param === 'number' ? { ...gate, param: visualization.circuit_params[i++] } : gate));
+		return { circuit: { ...prev.circuit, gates } };
+	}
+	if (visualization.network_weights && prev && prev.network) {
+		const layers = prev.network.layers.map((layer, i) => ({ ...layer, weights: visualization.network_weights[i] }));
+		return { network: { ...prev.network, layers } };
+	}
+	return prev;
+}
+
 export default function CreatureCanvas({ snapshot, gridSize = 9, showVisuals = true }) {
 	const canvasReference = useRef(null);
 	const canvasContainerRef = useRef(null);
@@ -58,7 +75,7 @@ export default function CreatureCanvas({ snapshot, gridSize = 9, showVisuals = t
 		if (snapshot.best) {
 			setBest(snapshot.best);
 			if (snapshot.best.visualization) {
-				setLastVisualization(snapshot.best.visualization);
+				setLastVisualization((prev) => applyVisualization(prev, snapshot.best.visualization));
 			}
 		}
 		if (snapshot.grid) {